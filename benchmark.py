@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import av
+import cv2
+import numpy as np
+from datetime import datetime, timedelta
+from camera_manager import CameraManager, RECORD_MODES
+from buffer_video_writer import TIMESTAMP_MODES
+
+SOURCE_CODECS = {'h264': ('libx264', 'yuv420p'), 'mjpeg': ('mjpeg', 'yuvj420p')}
+
+def make_source(path, width, height, fps, seconds, codec="h264"):
+    # A moving gradient with a bouncing box, enough motion that the decoder
+    # and the MJPEG encoder do real work
+    codec_name, pix_fmt = SOURCE_CODECS[codec]
+    output = av.open(path, 'w')
+    stream = output.add_stream(codec_name, rate=fps)
+    stream.width, stream.height = width, height
+    stream.pix_fmt = pix_fmt
+    if codec == "h264":
+        stream.codec_context.options = {'preset': 'veryfast', 'g': str(fps * 2)}
+    gradient = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    box = max(8, height // 8)
+    for n in range(int(fps * seconds)):
+        shifted = np.roll(gradient, n * 4, axis=1)
+        image = np.dstack([shifted, shifted[:, ::-1], np.full_like(gradient, (n * 3) % 256)])
+        x = (n * 7) % max(1, width - box)
+        y = (n * 5) % max(1, height - box)
+        image[y:y + box, x:x + box] = 255
+        frame = av.VideoFrame.from_ndarray(image, format='bgr24')
+        for packet in stream.encode(frame):
+            output.mux(packet)
+    for packet in stream.encode():
+        output.mux(packet)
+    output.close()
+
+def make_loop(source_path, loops):
+    # An ffconcat playlist that plays the source back to back, so a short file
+    # behaves like an endless stream for both cv2 (CAP_FFMPEG) and PyAV
+    playlist = os.path.splitext(source_path)[0] + ".ffconcat"
+    with open(playlist, 'w') as f:
+        f.write("ffconcat version 1.0\n")
+        f.write(f"file '{os.path.basename(source_path)}'\n" * loops)
+    return playlist
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmark(sources, duration, record_mode="mjpeg", frame_timing="pts", chunk_seconds=10, workdir=None):
+    # Records the sources with a CameraManager for duration seconds inside
+    # workdir (recordings/ and logs/ end up there) and returns the results
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        manager = CameraManager(sources, record_mode=record_mode, frame_timing=frame_timing, read_timeout=2.0)
+        manager.chunk_duration = timedelta(seconds=chunk_seconds)
+        cpu_start, wall_start = time.process_time(), time.time()
+        manager.start_stream_threads()
+        manager.start_recording()
+        time.sleep(duration)
+        elapsed = time.time() - wall_start
+        cpu = time.process_time() - cpu_start
+        cameras = []
+        for i, name in enumerate(manager.camera_names):
+            metrics = manager.metrics
+            counts = metrics.writer_counts(i)
+            decode, rollover, finalize = metrics.decode[i], metrics.rollover[i], metrics.finalize[i]
+            cameras.append({
+                'camera': name,
+                'fps': metrics.captured[i].total / elapsed,
+                'frames': metrics.captured[i].total,
+                'written': counts['written'],
+                'dropped': counts['dropped'],
+                'overrun': counts['overrun'],
+                'bytes_per_second': counts['bytes'] / elapsed,
+                'decode_ms': 1000 * decode.sum / decode.count if decode.count else None,
+                'rollovers': rollover.count,
+                'rollover_ms_avg': 1000 * rollover.sum / rollover.count if rollover.count else None,
+                'rollover_ms_max': 1000 * rollover.max if rollover.count else None,
+                'finalize_ms_avg': 1000 * finalize.sum / finalize.count if finalize.count else None,
+                'reconnects': manager.connections.snapshot()[name]['outages'],
+            })
+        manager.stop_recording()
+        manager.stop_stream_threads(timeout=manager.connections.open_timeout)
+        manager.release()
+    finally:
+        os.chdir(cwd)
+
+    cpu_percent = 100 * cpu / elapsed
+    return {
+        'cameras': cameras,
+        'totals': {
+            'fps': sum(camera['fps'] for camera in cameras),
+            'dropped': sum(camera['dropped'] + camera['overrun'] for camera in cameras),
+            'cpu_percent': cpu_percent,
+            'cpu_percent_per_stream': cpu_percent / len(cameras),
+            # ru_maxrss is in kilobytes on Linux
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'elapsed': elapsed,
+        },
+    }
+
+def find_baseline(path, config):
+    # Last earlier run of the same configuration in the results file
+    if not os.path.exists(path):
+        return None
+    baseline = None
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['config'] == config:
+                baseline = record
+    return baseline
+
+def print_report(record, baseline=None):
+    print(f"{'camera':<10}{'fps':>8}{'dropped':>9}{'decode ms':>11}{'MB/s':>8}{'rollover ms':>13}{'finalize ms':>13}")
+    for camera in record['cameras']:
+        print(f"{camera['camera']:<10}{camera['fps']:>8.1f}{camera['dropped'] + camera['overrun']:>9}"
+              f"{camera['decode_ms'] or 0:>11.2f}{camera['bytes_per_second'] / 1e6:>8.2f}"
+              f"{camera['rollover_ms_max'] or 0:>13.2f}{camera['finalize_ms_avg'] or 0:>13.1f}")
+    totals = record['totals']
+    print(f"total fps {totals['fps']:.1f}, CPU {totals['cpu_percent']:.0f}% ({totals['cpu_percent_per_stream']:.0f}% per stream), "
+          f"max RSS {totals['max_rss_mb']:.0f} MB, dropped {totals['dropped']}")
+    if baseline:
+        print(f"compared to {baseline['timestamp']} ({baseline['host']['revision']}):")
+        for key in ('fps', 'cpu_percent_per_stream', 'max_rss_mb', 'dropped'):
+            before, after = baseline['totals'][key], totals[key]
+            change = f"{100 * (after - before) / before:+.1f}%" if before else "n/a"
+            print(f"  {key}: {before:.1f} -> {after:.1f} ({change})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recording throughput with simulated cameras")
+    parser.add_argument('--source', action='append', default=[],
+                        help="Stream or file to record, e.g. a local RTSP server (repeatable). "
+                             "Without it synthetic sources are generated.")
+    parser.add_argument('--cameras', type=int, default=4, help="Number of synthetic cameras")
+    parser.add_argument('--resolution', default="1280x720")
+    parser.add_argument('--fps', type=int, default=25, help="Frame rate of the synthetic sources")
+    parser.add_argument('--source-codec', choices=SOURCE_CODECS, default="h264")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to record")
+    parser.add_argument('--chunk-seconds', type=float, default=10, help="Chunk length, short to exercise rollovers")
+    parser.add_argument('--record-mode', choices=RECORD_MODES, default="mjpeg")
+    parser.add_argument('--frame-timing', choices=TIMESTAMP_MODES, default="pts")
+    parser.add_argument('--output', default="benchmark_results.jsonl", help="Results are appended here as JSON lines")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated sources and recordings")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rtsp-benchmark-")
+    try:
+        sources = args.source
+        if not sources:
+            # File sources are read as fast as they decode, so the fps measured
+            # is the most the pipeline sustains rather than the camera rate
+            width, height = (int(value) for value in args.resolution.split('x'))
+            source_path = os.path.join(workdir, f"source.{'mkv' if args.source_codec == 'h264' else 'avi'}")
+            make_source(source_path, width, height, args.fps, seconds=10, codec=args.source_codec)
+            sources = [make_loop(source_path, loops=1000)] * args.cameras
+
+        config = {'sources': args.source or f"synthetic {args.cameras}x {args.resolution}@{args.fps} {args.source_codec}",
+                  'cameras': len(sources), 'duration': args.duration, 'chunk_seconds': args.chunk_seconds,
+                  'record_mode': args.record_mode, 'frame_timing': args.frame_timing}
+        result = run_benchmark(sources, args.duration, args.record_mode, args.frame_timing, args.chunk_seconds, workdir)
+    finally:
+        if args.keep:
+            print(f"Sources and recordings kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'host': {'cpu_count': os.cpu_count(), 'platform': platform.platform(), 'python': platform.python_version(),
+                 'opencv': cv2.__version__, 'pyav': av.__version__, 'revision': git_revision()},
+        'config': config,
+        **result,
+    }
+    baseline = find_baseline(args.output, config)
+    print_report(record, baseline)
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,53 @@
+import av
 import cv2
-import threading, queue, time
+import os
+import threading, time
 import logging
+from fractions import Fraction
+from writer_queue import WriterQueue, join_writer
+from recording_catalog import partial_path, streaming_options
+
+TIMESTAMP_MODES = ("cfr", "pts")
 
 class BufferedVideoWriter:
-    def __init__(self, filename, fourcc, fps, frameSize, maxBufferSize=25):
+    # timestamps="cfr" writes a constant frame rate file with cv2.VideoWriter and
+    # repeats frames to fill gaps. timestamps="pts" encodes every captured frame
+    # exactly once and stamps it with its capture time (VFR, needs a container
+    # that keeps timestamps such as .mkv). Until stop() the file is written
+    # under its partial_path name, so a half-written chunk is never mistaken
+    # for a finished one. With a stager the partial file is built at
+    # stagedFilename in the staging area and stop() has it copied to disk.
+    def __init__(self, filename, fourcc, fps, frameSize, maxBufferSize=25, frameRing=None, timestamps="cfr",
+                 overflowPolicy="drop_newest", blockTimeout=1.0, framePool=None, stager=None, stagedFilename=None,
+                 tracer=None, cameraName=None):
+        if timestamps not in TIMESTAMP_MODES:
+            raise ValueError(f"Unknown timestamp mode: {timestamps}. Expected one of {TIMESTAMP_MODES}")
         self.fourcc = fourcc
         self.thread = None
-        self.queue = queue.Queue()
         self.fps = fps
         self.maxBufferSize = maxBufferSize
         self.frameSize = frameSize
         self.filename = filename
+        self.stager = stager
+        self.partialFilename = stagedFilename if stager is not None else partial_path(filename)
+        # Frames queued from a FrameRing are views into shared slots, they are
+        # copied out and checked against their sequence number before being
+        # encoded.
+        self.frameRing = frameRing
+        # Frames from a FramePool are retained while queued and released once
+        # encoded or dropped
+        self.framePool = framePool
+        self.timestamps = timestamps
+        # Encoding of the frames the Tracer samples is recorded as "encode" spans
+        self.tracer = tracer
+        self.cameraName = cameraName
+        # written: captured frames encoded, padded: extra copies written to keep
+        # a constant rate, skipped: duplicates and frames ahead of the frame
+        # clock, overrun: ring slots recycled before they could be encoded
+        self.stats = {'written': 0, 'padded': 0, 'skipped': 0, 'overrun': 0}
+        self.queue = WriterQueue(maxBufferSize, overflowPolicy, blockTimeout, stats=self.stats, onDrop=self.release)
+        self.error = None  # The exception the writer thread died of
+        self.busySince = None  # Monotonic time the item being written was taken (or the thread died), None while waiting
         self.logger = logging.getLogger(__name__)
 
     def start(self):
@@ -22,31 +59,141 @@ class BufferedVideoWriter:
         dt = 1. / self.fps
         def loop():
             try:
-                writer = cv2.VideoWriter(filename=self.filename, fourcc=self.fourcc, fps=self.fps, frameSize=self.frameSize)
-                t = time.time()
-                self.queue.put((cv2.rectangle(self.frameSize, (0, 0), self.frameSize, (0, 0, 0), -1), t))
+                if self.timestamps == "pts":
+                    writer = PtsWriter(self.partialFilename, self.fps, self.frameSize)
+                else:
+                    writer = cv2.VideoWriter(filename=self.partialFilename, fourcc=self.fourcc, fps=self.fps, frameSize=self.frameSize)
+                t = None
+                last_seq = None
                 while self.thread or self.queue.qsize():
-                    frame, ts = self.queue.get()
-                    if frame is None:
+                    item = self.queue.get()
+                    if item is None:
                         break
-                    while t < ts:
-                        writer.write(frame)
-                        t += dt
+                    frame, ts, seq = item
+                    self.busySince = time.monotonic()
+                    try:
+                        if seq is not None:
+                            if last_seq is not None and seq <= last_seq:
+                                self.stats['skipped'] += 1
+                                continue
+                            if self.frameRing is not None:
+                                # The slot can be recycled at any time: copy it out,
+                                # then check it still held this frame while copying
+                                frame = frame.copy()
+                                if not self.frameRing.is_valid(seq):
+                                    self.stats['overrun'] += 1
+                                    continue
+                            last_seq = seq
+                        encode_start = time.perf_counter()
+                        if self.timestamps == "pts":
+                            writer.write(frame, ts)
+                            self.stats['written'] += 1
+                            if self.tracer is not None and self.tracer.sampled(seq):
+                                self.tracer.add("encode", self.cameraName, encode_start, seq=seq)
+                            continue
+                        if t is None:
+                            t = ts
+                        if ts < t:
+                            # The frame clock is already past this frame
+                            self.stats['skipped'] += 1
+                            continue
+                        copies = 0
+                        while t <= ts:
+                            writer.write(frame)
+                            t += dt
+                            copies += 1
+                        self.stats['written'] += 1
+                        self.stats['padded'] += copies - 1
+                        if self.tracer is not None and self.tracer.sampled(seq):
+                            self.tracer.add("encode", self.cameraName, encode_start, seq=seq)
+                    finally:
+                        self.busySince = None
+                        self.release(item)
+                self.busySince = time.monotonic()  # Closing the file can hang on a stuck disk too
                 writer.release()
             except Exception as e:
+                # The thread is gone, the camera manager's watchdog sees the
+                # error and replaces the writer
+                self.busySince = time.monotonic()
+                self.error = e
                 self.logger.error(f"Error in BufferedVideoWriter loop: {str(e)}")
 
-        self.thread = threading.Thread(target=loop)
+        # Daemon so a writer abandoned by the watchdog cannot keep the process alive
+        self.thread = threading.Thread(target=loop, name=f"writer-{os.path.basename(self.filename)}", daemon=True)
         self.thread.start()
 
-    def stop(self):
+    def stop(self, stallTimeout=None):
+        # Returns False, leaving the partial file to recovery, if the thread
+        # got stuck on one item for longer than stallTimeout seconds or died
+        # with an error
         if not self.thread:
-            return
-        self.write(None)
+            return True
+        self.queue.close()
         t = self.thread
         self.thread = None
-        t.join()
-        
-    def write(self, image):
-        if self.thread and self.queue.qsize() < self.maxBufferSize:
-            return self.queue.put((image, time.time()))
\ No newline at end of file
+        if not join_writer(t, self, stallTimeout) or self.error is not None:
+            self.abandon()
+            return False
+        for item in self.queue.drain():
+            self.release(item)
+        if self.stager is not None:
+            self.stager.commit(self.partialFilename, self.filename)
+        elif os.path.exists(self.partialFilename):
+            os.replace(self.partialFilename, self.filename)
+        return True
+
+    def abandon(self):
+        # Gives up on a writer whose thread is stuck. The thread is left to
+        # finish or hang on its own and the queued frames are dropped; the
+        # partial file (moved to disk if it was staged) is picked up by
+        # recovery at the next start.
+        self.thread = None
+        for item in self.queue.drain():
+            self.release(item)
+        self.queue.close()
+        if self.stager is not None:
+            self.stager.evacuate(self.partialFilename, self.filename)
+
+    def write(self, image, timestamp=None, seq=None):
+        if self.thread:
+            item = (image, timestamp if timestamp is not None else time.time(), seq)
+            if self.framePool is not None:
+                self.framePool.retain(image)
+            if not self.queue.put(item):
+                self.release(item)
+                return False
+            return True
+
+    def release(self, item):
+        if self.framePool is not None:
+            self.framePool.release(item[0])
+
+class PtsWriter:
+    # MJPEG encoder with millisecond presentation timestamps, same
+    # write/release interface as cv2.VideoWriter plus the capture time
+    def __init__(self, filename, fps, frameSize):
+        self.output = av.open(filename, 'w', container_options=streaming_options(filename))
+        self.stream = self.output.add_stream('mjpeg', rate=fps)
+        self.stream.width, self.stream.height = frameSize
+        self.stream.pix_fmt = 'yuvj420p'
+        self.stream.codec_context.time_base = Fraction(1, 1000)
+        self.stream.time_base = Fraction(1, 1000)
+        self.stream.codec_context.options = {'qmin': '1', 'qmax': '3'}
+        self.start_time = None
+        self.last_pts = -1
+
+    def write(self, frame, timestamp):
+        if self.start_time is None:
+            self.start_time = timestamp
+        pts = max(int(round((timestamp - self.start_time) * 1000)), self.last_pts + 1)
+        video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+        video_frame.pts = pts
+        video_frame.time_base = self.stream.codec_context.time_base
+        for packet in self.stream.encode(video_frame):
+            self.output.mux(packet)
+        self.last_pts = pts
+
+    def release(self):
+        for packet in self.stream.encode():
+            self.output.mux(packet)
+        self.output.close()
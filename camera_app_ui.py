@@ -1,30 +1,56 @@
 import tkinter as tk
 from tkinter import messagebox
 from PIL import Image, ImageTk
-import threading
-from datetime import datetime
-import queue
-import cv2
+import math
 import time
+import numpy as np
+import cv2
+
+PREVIEW_LAYOUTS = ("tiles", "mosaic")
 
 class CameraAppUI:
-    def __init__(self, root, camera_manager):
+    # layout="tiles" shows one label per camera side by side, layout="mosaic"
+    # draws every camera into a single grid image, which scales to many
+    # cameras with one PhotoImage update per refresh.
+    def __init__(self, root, camera_manager, layout="tiles", preview_fps=15, mosaic_size=(1280, 960)):
+        if layout not in PREVIEW_LAYOUTS:
+            raise ValueError(f"Unknown preview layout: {layout}. Expected one of {PREVIEW_LAYOUTS}")
         self.root = root
         self.root.title("Hikvision Camera Stream")
         self.camera_manager = camera_manager
         self.logger = camera_manager.logger
         self.recording = False
-        self.video_label_width = 640
-        self.video_label_height = 480
-        self.frame_buffers = [queue.Queue(maxsize=5) for _ in range(len(camera_manager.captures))]
+        self.layout = layout
+        self.preview_fps = preview_fps
+        num_cameras = len(camera_manager.captures)
+        if layout == "mosaic":
+            self.mosaic_columns = math.ceil(math.sqrt(num_cameras))
+            self.mosaic_rows = math.ceil(num_cameras / self.mosaic_columns)
+            self.video_label_width = mosaic_size[0] // self.mosaic_columns
+            self.video_label_height = mosaic_size[1] // self.mosaic_rows
+        else:
+            self.video_label_width = 640
+            self.video_label_height = 480
+        # Newest preview frame per camera as (rgb, seq), already scaled to the
+        # tile size by the capture thread; the Tk loop only redraws tiles whose
+        # seq changed since they were last shown.
+        self.preview_frames = [None] * num_cameras
+        self.shown_seqs = [None] * num_cameras
         self.video_labels = []
+        self.video_images = []
         self.status_labels = []
+        self.mosaic = None
 
         self.create_widgets()
-        self.start_stream_threads()
+        self.camera_manager.add_frame_listener(self.buffer_frame, max_fps=self.preview_fps)
+        self.camera_manager.add_status_listener(self.update_status)
+        self.camera_manager.start_stream_threads()
         self.start_recording()
 
     def create_widgets(self):
+        if self.layout == "mosaic":
+            self.create_mosaic_widgets()
+            return
         video_frames = []
         for i in range(len(self.camera_manager.captures)):
             # Status label
@@ -38,27 +64,63 @@ class CameraAppUI:
             video_frames.append(video_frame)
 
             # Video label
-            video_label = tk.Label(video_frame, width=self.video_label_width, height=self.video_label_height)
+            # The PhotoImage is created once and repainted in place
+            video_image = ImageTk.PhotoImage("RGB", (self.video_label_width, self.video_label_height))
+            video_label = tk.Label(video_frame, image=video_image, width=self.video_label_width, height=self.video_label_height)
             video_label.pack()
             self.video_labels.append(video_label)
+            self.video_images.append(video_image)
 
         self.toggle_button = tk.Button(self.root, text="Stop Recording", command=self.toggle_recording)
         self.toggle_button.grid(row=2, column=0, columnspan=len(self.camera_manager.captures), padx=5, pady=5)
 
         self.update_video_stream()
 
+    def create_mosaic_widgets(self):
+        status_bar = tk.Frame(self.root)
+        status_bar.grid(row=0, column=0, padx=5, pady=5)
+        for i in range(len(self.camera_manager.captures)):
+            status_label = tk.Label(status_bar, text="Status: Disconnected", bg="red", fg="white")
+            status_label.grid(row=i // self.mosaic_columns, column=i % self.mosaic_columns, padx=2, pady=2)
+            self.status_labels.append(status_label)
+
+        mosaic_width = self.video_label_width * self.mosaic_columns
+        mosaic_height = self.video_label_height * self.mosaic_rows
+        self.mosaic = np.zeros((mosaic_height, mosaic_width, 3), dtype=np.uint8)
+        video_frame = tk.Frame(self.root, width=mosaic_width, height=mosaic_height, bg="black")
+        video_frame.grid(row=1, column=0, padx=5, pady=5)
+        video_image = ImageTk.PhotoImage("RGB", (mosaic_width, mosaic_height))
+        video_label = tk.Label(video_frame, image=video_image, width=mosaic_width, height=mosaic_height)
+        video_label.pack()
+        self.video_labels.append(video_label)
+        self.video_images.append(video_image)
+
+        self.toggle_button = tk.Button(self.root, text="Stop Recording", command=self.toggle_recording)
+        self.toggle_button.grid(row=2, column=0, padx=5, pady=5)
+
+        self.update_video_stream()
+
     def update_video_stream(self):
-        for i in range(len(self.frame_buffers)):
-            if not self.frame_buffers[i].empty():
-                frame = self.frame_buffers[i].get()
-                self.camera_manager.frames[i] = frame
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frame = cv2.resize(frame, (self.video_label_width, self.video_label_height))
-                img = Image.fromarray(frame)
-                imgtk = ImageTk.PhotoImage(image=img)
-                self.video_labels[i].imgtk = imgtk
-                self.video_labels[i].configure(image=imgtk)
-        self.root.after(10, self.update_video_stream)
+        changed = False
+        tracer = self.camera_manager.tracer
+        for i, preview in enumerate(self.preview_frames):
+            if preview is None or preview[1] == self.shown_seqs[i]:
+                continue
+            paint_start = time.perf_counter()
+            frame, self.shown_seqs[i] = preview
+            self.camera_manager.metrics.frame_previewed(i, time.time())
+            if self.mosaic is not None:
+                row, column = divmod(i, self.mosaic_columns)
+                y, x = row * self.video_label_height, column * self.video_label_width
+                self.mosaic[y:y + self.video_label_height, x:x + self.video_label_width] = frame
+                changed = True
+            else:
+                self.video_images[i].paste(Image.fromarray(frame))
+            if tracer is not None and tracer.sampled(self.shown_seqs[i]):
+                tracer.add("paint", self.camera_manager.camera_names[i], paint_start, seq=self.shown_seqs[i])
+        if changed:
+            self.video_images[0].paste(Image.fromarray(self.mosaic))
+        self.root.after(max(1, 1000 // self.preview_fps), self.update_video_stream)
 
     def start_recording(self):
         if not self.recording:
@@ -66,21 +128,12 @@ class CameraAppUI:
             for video_frame in self.video_labels:
                 video_frame.master.config(highlightbackground="red", highlightcolor="red", highlightthickness=2)
             self.toggle_button.config(text="Stop Recording")
-            self.camera_manager.recording = True
-            self.camera_manager.chunk_indices = [0] * len(self.camera_manager.captures)
-            self.camera_manager.chunk_start_times = [datetime.now()] * len(self.camera_manager.captures)
-
-            for i in range(len(self.camera_manager.captures)):
-                self.camera_manager.start_new_chunk(i)
-
-            self.recording_thread = threading.Thread(target=self.camera_manager.record_video)
-            self.recording_thread.start()
+            self.camera_manager.start_recording()
 
     def stop_recording(self):
         if self.recording:
             self.camera_manager.stop_recording()
             self.recording = False
-            self.recording_thread.join()
 
             for video_frame in self.video_labels:
                 video_frame.master.config(highlightbackground="black", highlightcolor="black", highlightthickness=0)
@@ -93,38 +146,20 @@ class CameraAppUI:
         else:
             self.start_recording()
 
-    def stream_camera(self, i):
-        last_frame_time = time.time()
-        reconnect_delay = 5  # Delay between reconnection attempts in seconds
-        camera_name = f"Camera {i+1}"
-
-        while True:
-            try:
-                if not self.camera_manager.camera_connected[i]:
-                    if self.camera_manager.attempt_reconnection(i):
-                        last_frame_time = time.time()
-                    else:
-                        time.sleep(reconnect_delay)
-                        continue
-
-                ret, frame = self.camera_manager.captures[i].read()
-                if ret:
-                    last_frame_time = time.time()
-                    if self.frame_buffers[i].full():
-                        self.frame_buffers[i].get()
-                    self.frame_buffers[i].put(frame)
-                    if self.status_labels[i].cget("text") != "Status: Connected":
-                        self.status_labels[i].config(text="Status: Connected", bg="green", fg="white")
-                else:
-                    if time.time() - last_frame_time > reconnect_delay:
-                        self.camera_manager.handle_disconnection(i)
-                        self.status_labels[i].config(text=f"Status: Reconnecting Camera {i+1}", bg="orange", fg="black")
-                        time.sleep(reconnect_delay)
-            except Exception as e:
-                self.camera_manager.log_error(str(e), camera_name)
-                print(e)
-                time.sleep(1)
-
-    def start_stream_threads(self):
-        for i in range(len(self.camera_manager.captures)):
-            threading.Thread(target=self.stream_camera, args=(i,), daemon=True).start()
\ No newline at end of file
+    def buffer_frame(self, i, frame, timestamp, seq):
+        # Runs on the capture thread, at most preview_fps times a second (frames
+        # in between are never decoded). Frames are shrunk to the tile size
+        # before the colour conversion so the Tk loop never touches a full
+        # resolution frame.
+        preview_start = time.perf_counter()
+        small = cv2.resize(frame, (self.video_label_width, self.video_label_height), interpolation=cv2.INTER_LINEAR)
+        self.preview_frames[i] = (cv2.cvtColor(small, cv2.COLOR_BGR2RGB), seq)
+        tracer = self.camera_manager.tracer
+        if tracer is not None and tracer.sampled(seq):
+            tracer.add("preview", self.camera_manager.camera_names[i], preview_start, seq=seq)
+
+    def update_status(self, i, status):
+        if status == "connected":
+            self.status_labels[i].config(text="Status: Connected", bg="green", fg="white")
+        else:
+            self.status_labels[i].config(text=f"Status: Reconnecting Camera {i+1}", bg="orange", fg="black")
@@ -1,128 +1,852 @@
 import cv2
 import os
 from logger import Logger
-from buffer_video_writer import BufferedVideoWriter
+import time
+import threading
+import collections
+from buffer_video_writer import BufferedVideoWriter, TIMESTAMP_MODES
+from packet_capture import PacketCapture
+from stream_copy_writer import StreamCopyWriter
+from frame_ring import FrameRing
+from frame_pool import FramePool
+from writer_queue import OVERFLOW_POLICIES
+from motion_detector import MotionDetector
+from recording_catalog import RecordingCatalog
+from segment_recovery import recover_segments, lock_cameras
+from segment_thumbnails import SegmentThumbnails
+from segment_staging import SegmentStager
+from connection_supervisor import ConnectionSupervisor
+from pipeline_watchdog import Watchdog, STALL_GRACE
+from tracing import Tracer
+from metrics import CameraMetrics
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+
+RECORD_MODES = ("mjpeg", "copy")
+COPY_CONTAINERS = ("mkv", "mp4", "ts")
+RECORD_TRIGGERS = ("continuous", "motion")
+
+def default_camera_name(i):
+    if i == 0:
+        return "front"
+    return "rear" if i == 1 else f"rear{i}"
 
 class CameraManager:
-    def __init__(self, camera_urls):
+    def __init__(self, camera_urls, record_mode="mjpeg", container="mkv", camera_names=None, ring_slots=0, frame_timing="pts",
+                 overflow_policy=None, max_buffer_size=None, record_trigger="continuous", pre_roll=3.0, post_roll=5.0,
+                 open_timeout=10.0, read_timeout=5.0, max_concurrent_opens=8, motion_fps=5.0,
+                 thumbnail_fps=1.0, frame_pool_size=None, staging_limit=None, staging_dir=None, fsync_policy="file",
+                 trace_every=None, require_connection=True):
+        if record_mode not in RECORD_MODES:
+            raise ValueError(f"Unknown record mode: {record_mode}. Expected one of {RECORD_MODES}")
+        if container not in COPY_CONTAINERS:
+            raise ValueError(f"Unknown container: {container}. Expected one of {COPY_CONTAINERS}")
+        if frame_timing not in TIMESTAMP_MODES:
+            raise ValueError(f"Unknown frame timing: {frame_timing}. Expected one of {TIMESTAMP_MODES}")
+        if record_trigger not in RECORD_TRIGGERS:
+            raise ValueError(f"Unknown record trigger: {record_trigger}. Expected one of {RECORD_TRIGGERS}")
+        if overflow_policy is not None and overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}. Expected one of {OVERFLOW_POLICIES}")
+
         self.logger = Logger()
         self.logger.log_recording_start()
 
         os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = 'rtsp_transport;tcp'
         self.camera_urls = camera_urls
+        self.camera_names = camera_names or [default_camera_name(i) for i in range(len(camera_urls))]
+        self.record_mode = record_mode
+        self.container = container
+        self.ring_slots = ring_slots
+        self.frame_timing = frame_timing
+        # Packets can only be dropped by whole GOPs, decoded frames one by one
+        self.overflow_policy = overflow_policy or ("keyframe" if record_mode == "copy" else "drop_newest")
+        self.max_buffer_size = max_buffer_size or (250 if record_mode == "copy" else 25)
+        # With the "motion" trigger a chunk is only open while there is motion,
+        # plus post_roll seconds after it. The last pre_roll seconds are kept in
+        # memory and go to the start of the chunk. A ring is made big enough for
+        # the writer queue and the pre-roll whatever ring_slots says, or queued
+        # frames would be overwritten before they are encoded.
+        self.record_trigger = record_trigger
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        # Motion detection only looks at this many frames a second
+        self.motion_interval = 1.0 / motion_fps
+        # Each segment gets a sprite of thumbnails taken at thumbnail_fps (0 turns them off).
+        # In copy mode they are only taken from keyframes, so at most one a GOP.
+        self.thumbnails = SegmentThumbnails() if thumbnail_fps else None
+        self.thumbnail_interval = 1.0 / thumbnail_fps if thumbnail_fps else None
+        self.recording = False
         self.output_dir = os.path.join(os.getcwd(), "recordings")
         os.makedirs(self.output_dir, exist_ok=True)
-        
-        self.captures = [cv2.VideoCapture(url, cv2.CAP_FFMPEG) for url in camera_urls]
+        self.catalog = RecordingCatalog(self.output_dir)
+        # With a staging_limit (bytes), segments are built in RAM (staging_dir,
+        # tmpfs by default) and copied to the recordings directory in one go
+        self.stager = SegmentStager(self.output_dir, self.camera_names, staging_dir=staging_dir, limit=staging_limit,
+                                    fsync=fsync_policy) if staging_limit else None
+        # Segments a crash left unfinished are closed out before new ones start,
+        # except for cameras another live process is recording
+        self.camera_locks, busy_cameras = lock_cameras(self.output_dir, self.camera_names)
+        for camera_name in busy_cameras:
+            self.logger.log_error("Camera is being recorded by another process, its segments are not recovered",
+                                  camera_name)
+        recover_segments(self.catalog, [name for name in self.camera_names if name not in busy_cameras], self.logger,
+                         self.stager)
+        self.metrics = CameraMetrics(self.camera_names)
+        # With trace_every, stage timings of one frame in trace_every (and of
+        # every chunk) are kept for export, see Tracer
+        self.tracer = Tracer(sample_every=trace_every) if trace_every else None
+        self.connections = ConnectionSupervisor(self.camera_names, open_timeout=open_timeout, read_timeout=read_timeout,
+                                                max_concurrent_opens=max_concurrent_opens)
+
+        # A capture thread the watchdog gave up on is replaced by a new one;
+        # the generation tells the old thread it no longer owns the camera
+        self.stream_generations = [0] * len(camera_urls)
+        self.capture_beats = [None] * len(camera_urls)
+        self.capture_allowances = [0.0] * len(camera_urls)
+        self.watchdog = Watchdog(self.logger)
+        for i, camera_name in enumerate(self.camera_names):
+            self.watchdog.watch("capture", camera_name, lambda i=i: self.capture_progress(i),
+                                lambda i=i: self.restart_capture(i))
+            self.watchdog.watch("writer", camera_name, lambda i=i: self.writer_progress(i),
+                                lambda i=i: self.restart_writer(i))
+
+        # All cameras are opened at the same time, a slow one only delays startup by its own open timeout
+        with ThreadPoolExecutor(max_workers=max(1, len(camera_urls))) as executor:
+            self.captures = list(executor.map(self.connect_capture, range(len(camera_urls))))
         self.video_writers = [None] * len(camera_urls)
-        self.frames = [None] * len(camera_urls)
+        self.frame_rings = [None] * len(camera_urls)
+        # Without a ring, frames are decoded into a per-camera FramePool; its size
+        # (None: enough for a full writer queue and the pre-roll, 0: no pool)
+        # caps the memory held by decoded frames. Frames are allocated as they
+        # are needed, so a pool only grows as far as the queue actually backs up.
+        self.frame_pool_size = frame_pool_size
+        self.frame_pools = [None] * len(camera_urls)
+        self.frame_seqs = [0] * len(camera_urls)
+        self.writer_locks = [threading.Lock() for _ in camera_urls]
+        self.frame_listeners = []
+        self.status_listeners = []
+        self.chunk_listeners = []
+        self.streaming = False
+        self.stream_threads = []
         self.chunk_start_times = [None] * len(camera_urls)
         self.chunk_duration = timedelta(minutes=1)
-        current_date_str = datetime.now().strftime('%Y%m%d')
-        self.chunk_indices = [self.get_last_index(f"front" if i == 0 else "rear", current_date_str) for i in range(len(camera_urls))]
-        self.camera_connected = [True] * len(camera_urls)
-
-        for capture in self.captures:
-            if not capture.isOpened():
-                raise ValueError('Cannot open RTSP stream. Possibly the URL/video is broken')
+        self.preopen_lead = timedelta(seconds=2)  # How long before the boundary the next chunk is opened
+        self.next_chunks = [None] * len(camera_urls)
+        # Chunks opened in the background to replace a writer the watchdog abandoned
+        self.replacement_chunks = [None] * len(camera_urls)
+        # Opening upcoming chunks and finalizing finished ones never runs on a capture thread
+        self.chunk_executor = ThreadPoolExecutor(max_workers=max(2, len(camera_urls)), thread_name_prefix="chunk")
+        self.finalizing_chunks = set()
+        self.chunk_indices = [None] * len(camera_urls)
+        self.camera_connected = [capture.isOpened() for capture in self.captures]
+        self.motion_detectors = [MotionDetector() for _ in camera_urls]
+        self.motion_until = [0.0] * len(camera_urls)
+        self.motion_checks = [0.0] * len(camera_urls)
+        self.thumbnail_times = [0.0] * len(camera_urls)
+        self.pre_rolls = [collections.deque() for _ in camera_urls]
 
-    def get_last_index(self, camera_name, date_str):
-        max_index = -1
-        date_dir = os.path.join(self.output_dir, date_str)
+        # A supervised worker passes require_connection=False: with no camera up
+        # it keeps running and leaves them all to the reconnect backoff
+        # instead of being restarted in a loop
+        if require_connection and not any(self.camera_connected):
+            raise ValueError('Cannot open RTSP stream. Possibly the URL/video is broken')
+        for i, connected in enumerate(self.camera_connected):
+            if not connected:
+                # Retried with backoff by its capture thread
+                self.log_error("Cannot open RTSP stream, will keep retrying", i)
 
-        if not os.path.exists(date_dir):
-            return 0
+        for i, capture in enumerate(self.captures):
+            width, height = int(capture.get(3)), int(capture.get(4))
+            if width and height:
+                if self.ring_slots:
+                    self.setup_frame_ring(i, (height, width, 3))
+                elif self.frame_pool_size != 0:
+                    self.setup_frame_pool(i, (height, width, 3))
 
-        for filename in os.listdir(date_dir):
-            if filename.startswith(camera_name) and date_str in filename:
-                try:
-                    index = int(filename.split('_')[-1].split('.')[0])
-                    if index > max_index:
-                        max_index = index
-                except (ValueError, IndexError):
-                    pass
+    def open_capture(self, i):
+        if self.record_mode == "copy":
+            capture = PacketCapture(self.camera_urls[i], timeout=self.connections.av_timeout())
+            generation = self.stream_generations[i]
+            capture.packet_sink = lambda packet: generation == self.stream_generations[i] and self.write_packet(i, packet)
+            return capture
+        return cv2.VideoCapture(self.camera_urls[i], cv2.CAP_FFMPEG, self.connections.capture_params())
 
-        return max_index + 1
+    def connect_capture(self, i):
+        return self.connections.open(i, lambda: self.open_capture(i))
 
-    def start_new_chunk(self, i):
-        current_date_str = datetime.now().strftime('%Y%m%d')
-        date_dir = os.path.join(self.output_dir, current_date_str)
+    def open_chunk_writer(self, i, start_time):
+        open_start = time.perf_counter()
+        date_str = start_time.strftime('%Y%m%d')
+        date_dir = os.path.join(self.output_dir, date_str)
         os.makedirs(date_dir, exist_ok=True)
-        
-        camera_name = "front" if i == 0 else "rear"
-        self.chunk_indices[i] = self.get_last_index(camera_name, current_date_str)
-        video_filename = f"{camera_name}_{self.chunk_start_times[i].strftime('%Y%m%d_%H%M%S')}_{self.chunk_indices[i]}.avi"
+
+        camera_name = self.camera_names[i]
+        index = self.catalog.next_index(camera_name, date_str)
+        if self.record_mode == "copy":
+            extension = self.container
+        else:
+            # Constant frame rate MJPEG keeps the historical .avi chunks
+            extension = "mkv" if self.frame_timing == "pts" else "avi"
+        video_filename = f"{camera_name}_{start_time.strftime('%Y%m%d_%H%M%S')}_{index}.{extension}"
         video_path = os.path.join(date_dir, video_filename)
-        frame_width = int(self.captures[i].get(3))
-        frame_height = int(self.captures[i].get(4))
         fps = int(self.captures[i].get(cv2.CAP_PROP_FPS))
-        video_codec = cv2.VideoWriter_fourcc('M', 'J', 'P', 'G')
-        self.video_writers[i] = BufferedVideoWriter(video_path, video_codec, fps, (frame_width, frame_height))
-        self.video_writers[i].start()
-        self.chunk_start_times[i] = datetime.now()
-        self.logger.log_file_start(camera_name, video_filename)
+        max_buffer_size = self.max_buffer_size
+        if self.record_trigger == "motion":
+            # The pre-roll is queued in one go when motion starts
+            max_buffer_size += int(self.pre_roll * (fps or 30))
+        # Written to disk directly when the staging area is full
+        staged_path = self.stager.stage(camera_name, video_path) if self.stager else None
+        stager = self.stager if staged_path else None
+        if self.record_mode == "copy":
+            writer = StreamCopyWriter(video_path, self.captures[i].stream, maxBufferSize=max_buffer_size,
+                                      overflowPolicy=self.overflow_policy, stager=stager, stagedFilename=staged_path)
+        else:
+            frame_width = int(self.captures[i].get(3))
+            frame_height = int(self.captures[i].get(4))
+            video_codec = cv2.VideoWriter_fourcc('M', 'J', 'P', 'G')
+            writer = BufferedVideoWriter(video_path, video_codec, fps, (frame_width, frame_height),
+                                         maxBufferSize=max_buffer_size, frameRing=self.frame_rings[i], framePool=self.frame_pools[i],
+                                         timestamps=self.frame_timing, overflowPolicy=self.overflow_policy,
+                                         stager=stager, stagedFilename=staged_path,
+                                         tracer=self.tracer, cameraName=camera_name)
+        writer.start()
+        if self.tracer is not None:
+            self.tracer.add("open_chunk", camera_name, open_start)
+        return writer, index
+
+    def start_new_chunk(self, i, first_frame_time=None):
+        writer, self.chunk_indices[i] = self.open_chunk_writer(i, self.chunk_start_times[i])
+        self.activate_chunk(i, writer, first_frame_time)
+
+    def activate_chunk(self, i, writer, first_frame_time=None):
+        # The catalog start_time is the capture time of the chunk's first frame,
+        # which is now unless the chunk starts with older frames (the pre-roll)
+        self.video_writers[i] = writer
+        self.metrics.writer_started(i, writer)
+        self.chunk_start_times[i] = datetime.fromtimestamp(first_frame_time) if first_frame_time else datetime.now()
+        codec = self.captures[i].stream.codec_context.name if self.record_mode == "copy" else "mjpeg"
+        self.catalog.open_segment(self.camera_names[i], writer.filename, self.chunk_indices[i],
+                                  self.chunk_start_times[i].timestamp(), codec)
+        if self.thumbnails is not None:
+            self.thumbnails.start(writer.filename, self.chunk_start_times[i].timestamp())
+        self.logger.log_file_start(self.camera_names[i], os.path.basename(writer.filename))
+        self.notify_chunk(i, "chunk_start", writer.filename)
+
+    def schedule_next_chunk(self, i):
+        # Opens the next segment in the background ahead of the boundary
+        if self.next_chunks[i] is None:
+            start_time = self.chunk_start_times[i] + self.chunk_duration
+            self.next_chunks[i] = self.chunk_executor.submit(self.open_chunk_writer, i, start_time)
+
+    def discard_next_chunk(self, future):
+        if future.exception() is not None:
+            return
+        writer, _ = future.result()
+        writer.stop(stallTimeout=self.writer_stall_timeout())
+        if os.path.exists(writer.filename):
+            os.remove(writer.filename)
+
+    def setup_frame_ring(self, i, shape):
+        # Shared-memory ring named after the camera, other processes can
+        # FrameRing.attach("rtsp_<camera name>") to read the live frames.
+        # A new frame size means a new ring, and a new chunk for the writer.
+        with self.writer_locks[i]:
+            was_recording = self.video_writers[i] is not None
+            self.close_chunk(i)
+            if self.frame_rings[i] is not None:
+                self.frame_rings[i].close()
+            self.frame_rings[i] = FrameRing.create(f"rtsp_{self.camera_names[i]}", shape,
+                                                    max(self.ring_slots, self.frames_in_flight(i)))
+            if was_recording:
+                self.chunk_start_times[i] = datetime.now()
+                self.start_new_chunk(i)
+        return self.frame_rings[i]
+
+    def frames_in_flight(self, i):
+        # Frames on the capture thread and the live view, plus whatever the
+        # recorder may hold on to
+        count = 4
+        if self.record_mode != "copy":
+            count += self.max_buffer_size
+            if self.record_trigger == "motion":
+                count += int(self.pre_roll * (int(self.captures[i].get(cv2.CAP_PROP_FPS)) or 30)) + 1
+        return count
+
+    def setup_frame_pool(self, i, shape):
+        # A new frame size means a new pool, and a new chunk whose writer
+        # retains its frames in that pool. Frames of the old pool still queued
+        # in the old writer are released into the old pool, which nobody
+        # decodes into anymore.
+        size = self.frame_pool_size if self.frame_pool_size is not None else self.frames_in_flight(i)
+        with self.writer_locks[i]:
+            was_recording = self.video_writers[i] is not None
+            self.close_chunk(i, background=True)
+            self.clear_pre_roll(i)
+            self.frame_pools[i] = FramePool(shape, size)
+            if was_recording:
+                self.chunk_start_times[i] = datetime.now()
+                self.start_new_chunk(i)
+        return self.frame_pools[i]
+
+    def retrieve_frame(self, i, capture, keyframe_only=False):
+        # Decodes the grabbed frame into a ring slot or a pooled buffer. Returns
+        # (True, None) when the pool is exhausted or the decoder has no frame
+        # out yet, the frame is then skipped. keyframe_only (copy mode, for a
+        # thumbnail) decodes just the grabbed keyframe.
+        retrieve = capture.retrieve_keyframe if keyframe_only else capture.retrieve
+        ring = self.frame_rings[i]
+        if ring is not None:
+            return retrieve(ring.next_slot()[1])
+        pool = self.frame_pools[i]
+        if pool is None:
+            ret, frame = retrieve()
+            if frame is not None and self.frame_pool_size != 0 and not self.ring_slots:
+                self.setup_frame_pool(i, frame.shape)
+            return ret, frame
+        buffer = pool.acquire()
+        if buffer is None and self.free_pre_roll(i):
+            buffer = pool.acquire()
+        if buffer is None:
+            self.metrics.frame_skipped(i)
+            return True, None
+        ret, frame = retrieve(buffer)
+        if frame is not buffer:
+            # Not decoded, or the frame size changed and the capture allocated a new frame
+            pool.release(buffer)
+            if frame is not None:
+                self.setup_frame_pool(i, frame.shape)
+        return ret, frame
+
+    def free_pre_roll(self, i):
+        # The pool ran out: the pre-roll gives up its oldest frame so decoding,
+        # and with it motion detection, goes on. Without this a pre-roll holding
+        # the whole pool is never trimmed again and no chunk ever opens.
+        with self.writer_locks[i]:
+            pre_roll = self.pre_rolls[i]
+            if not pre_roll or self.record_mode == "copy":
+                return False
+            self.release_items(i, pre_roll.popleft()[1])
+            return True
+
+    def retain_frame(self, i, frame):
+        # For consumers that keep a frame after the call it was passed in; every
+        # retain_frame needs a release_frame once the frame is no longer used
+        pool = self.frame_pools[i]
+        if pool is not None:
+            pool.retain(frame)
+
+    def release_frame(self, i, frame):
+        pool = self.frame_pools[i]
+        if pool is not None:
+            pool.release(frame)
+
+    def publish_frame(self, i, frame, timestamp):
+        # Returns the frame consumers should use and its per-camera sequence number.
+        # With a ring the frame is normally already decoded into its slot.
+        if not self.ring_slots:
+            self.frame_seqs[i] += 1
+            return frame, self.frame_seqs[i]
+        ring = self.frame_rings[i]
+        if ring is None or ring.shape != frame.shape:
+            ring = self.setup_frame_ring(i, frame.shape)
+        seq, slot = ring.next_slot()
+        if slot is not frame:
+            slot[...] = frame
+        ring.commit(seq, timestamp)
+        self.frame_seqs[i] = seq
+        return slot, seq
+
+    def add_frame_listener(self, listener, max_fps=None, cameras=None):
+        # listener(camera_index, frame, timestamp, seq) is called from the capture thread,
+        # at most max_fps times a second per camera, for the camera indices in cameras
+        # (all by default). The frame is only valid during the call: it is a pooled
+        # buffer that may be reused afterwards unless the listener takes a reference
+        # with retain_frame, or with ring_slots a view into shared memory that stays
+        # valid until FrameRing.is_valid(seq) turns False.
+        interval = 1.0 / max_fps if max_fps else 0.0
+        entry = (listener, interval, [0.0] * len(self.camera_urls), set(cameras) if cameras is not None else None)
+        # Replaced rather than appended to, capture threads may be iterating the old list
+        self.frame_listeners = self.frame_listeners + [entry]
+
+    def remove_frame_listener(self, listener):
+        self.frame_listeners = [entry for entry in self.frame_listeners if entry[0] != listener]
+
+    def frame_demand(self, i, now, keyframe=True):
+        # Who wants the frame just grabbed: (listeners due, motion check due, recorder, thumbnail due).
+        # A frame nobody wants is never retrieved. That saves the conversion to
+        # BGR, but decoding only partly: cv2 decodes in grab() anyway, and a
+        # PacketCapture has to decode every packet since the last retrieve (or
+        # keyframe) to produce the wanted frame, so only GOPs nobody asks for
+        # at all go undecoded. In copy mode a thumbnail is only due on a
+        # keyframe, which is decoded on its own (see retrieve_frame).
+        listeners = [entry for entry in self.frame_listeners
+                     if (entry[3] is None or i in entry[3]) and now - entry[2][i] >= entry[1]]
+        analyse = self.record_trigger == "motion" and self.recording and now - self.motion_checks[i] >= self.motion_interval
+        record = self.record_mode != "copy" and self.recording
+        thumbnail = (self.thumbnails is not None and self.video_writers[i] is not None
+                     and now - self.thumbnail_times[i] >= self.thumbnail_interval
+                     and (keyframe or self.record_mode != "copy"))
+        return listeners, analyse, record, thumbnail
+
+    def add_status_listener(self, listener):
+        # listener(camera_index, status) with status "connected" or "reconnecting"
+        self.status_listeners.append(listener)
+
+    def remove_status_listener(self, listener):
+        self.status_listeners = [entry for entry in self.status_listeners if entry != listener]
+
+    def add_chunk_listener(self, listener):
+        # listener(camera_index, event, path) with event "chunk_start", "chunk_saved"
+        # or "thumbnails_saved"
+        self.chunk_listeners.append(listener)
+
+    def notify_chunk(self, i, event, path):
+        for listener in self.chunk_listeners:
+            listener(i, event, path)
+
+    def notify_status(self, i, status):
+        for listener in self.status_listeners:
+            listener(i, status)
+
+    def start_stream_threads(self):
+        self.streaming = True
+        self.connections.start()
+        self.stream_threads = [threading.Thread(target=self.stream_camera, args=(i,), name=f"capture-{self.camera_names[i]}",
+                                                daemon=True) for i in range(len(self.captures))]
+        for thread in self.stream_threads:
+            thread.start()
+        self.watchdog.start()
+
+    def stop_stream_threads(self, timeout=None):
+        self.streaming = False
+        self.watchdog.stop()
+        self.connections.stop()  # Wakes threads waiting to retry a connection
+        for thread in self.stream_threads:
+            thread.join(timeout)
 
-    def record_video(self):
+    def beat_capture(self, i, allowance):
+        # The capture thread promises to be back within allowance seconds
+        self.capture_beats[i] = time.monotonic()
+        self.capture_allowances[i] = allowance
+
+    def capture_progress(self, i):
+        beat = self.capture_beats[i]
+        if beat is None or not self.streaming:
+            return None
+        return beat, self.capture_allowances[i]
+
+    def writer_stall_timeout(self):
+        return self.connections.read_timeout + STALL_GRACE
+
+    def writer_progress(self, i):
+        # Only a writer busy with an item can be stalled, an idle one waits for
+        # frames. One whose thread died is stalled as of its death.
+        writer = self.video_writers[i]
+        busy_since = writer.busySince if writer is not None else None
+        if busy_since is None:
+            return None
+        return busy_since, 0 if writer.error is not None else self.connections.read_timeout
+
+    def restart_capture(self, i):
+        # The capture thread is stuck inside the capture, typically a read on a
+        # half-dead session that never returns. A thread cannot be interrupted,
+        # so it is left behind with its capture (it releases it and exits if
+        # the call ever returns) and a new thread reconnects the camera.
+        self.stream_generations[i] += 1
+        self.capture_beats[i] = None
+        self.captures[i] = None
+        thread = threading.Thread(target=self.stream_camera, args=(i, True), name=f"capture-{self.camera_names[i]}", daemon=True)
+        self.stream_threads.append(thread)
+        thread.start()
+        return True
+
+    def restart_writer(self, i):
+        # The writer thread is stuck (blocked I/O, a hung encoder) or died with
+        # an error. It is abandoned and recording goes on in a new chunk,
+        # opened on the chunk executor and taken over by the capture thread
+        # with its next frame. Returns True once the writer is replaced, False
+        # when the capture thread holds the writer lock (it may be waiting on
+        # the same disk), the watchdog then tries again.
+        if not self.writer_locks[i].acquire(timeout=self.connections.read_timeout):
+            return False
+        try:
+            writer = self.video_writers[i]
+            if writer is None or writer.busySince is None:
+                return
+            self.video_writers[i] = None
+            writer.abandon()
+            self.metrics.writer_abandoned(i, writer)
+            if writer.error is not None:
+                self.logger.log_stage_error("writer", self.camera_names[i], str(writer.error))
+            if self.thumbnails is not None:
+                self.thumbnails.finish(writer.filename)
+            if self.next_chunks[i] is not None:
+                self.next_chunks[i].add_done_callback(self.discard_next_chunk)
+                self.next_chunks[i] = None
+            if self.recording and self.camera_connected[i] and self.record_trigger == "continuous":
+                self.chunk_start_times[i] = datetime.now()
+                self.replacement_chunks[i] = self.chunk_executor.submit(self.open_chunk_writer, i,
+                                                                        self.chunk_start_times[i])
+            return True
+        finally:
+            self.writer_locks[i].release()
+
+    def take_replacement_chunk(self, i):
+        # Capture thread, under the writer lock
+        future = self.replacement_chunks[i]
+        if future is None or not future.done():
+            return
+        self.replacement_chunks[i] = None
+        if future.exception() is not None:
+            self.log_error(f"Cannot open a new chunk: {str(future.exception())}", i)
+            return
+        writer, self.chunk_indices[i] = future.result()
+        self.activate_chunk(i, writer)
+
+    def stream_camera(self, i, takeover=False):
+        last_frame_time = time.time()
+        status = None
+        generation = self.stream_generations[i]
+        capture = None
+        if takeover and self.camera_connected[i]:
+            self.handle_disconnection(i)
+
+        while self.streaming and generation == self.stream_generations[i]:
+            try:
+                if not self.camera_connected[i]:
+                    if status != "reconnecting":
+                        status = "reconnecting"
+                        self.notify_status(i, status)
+                    self.capture_beats[i] = None  # Waiting out the backoff is not a stall
+                    if not self.connections.wait_before_retry(i):
+                        continue
+                    self.beat_capture(i, self.connections.open_timeout)
+                    if self.attempt_reconnection(i, generation):
+                        last_frame_time = time.time()
+                    continue
+
+                self.beat_capture(i, self.connections.read_timeout)
+                capture = self.captures[i]
+                # Every frame is grabbed to keep up with the stream, but only retrieved
+                # (converted, see frame_demand) when a consumer is due for one. In
+                # copy mode the packets are recorded as they are demuxed.
+                grab_start = time.perf_counter()
+                ret, frame = capture.grab(), None
+                grab_end = time.perf_counter()
+                if generation != self.stream_generations[i]:
+                    break  # Replaced by the watchdog while blocked in grab()
+                if ret:
+                    keyframe = self.record_mode != "copy" or capture.keyframe
+                    listeners, analyse, record, thumbnail = self.frame_demand(i, time.time(), keyframe)
+                    if listeners or analyse or record or thumbnail:
+                        decode_start = time.perf_counter()
+                        ret, frame = self.retrieve_frame(i, capture, keyframe_only=not (listeners or analyse or record))
+                        decode_end = time.perf_counter()
+                        self.metrics.decode[i].observe(decode_end - decode_start)
+                if ret:
+                    last_frame_time = time.time()
+                    self.metrics.frame_captured(i, last_frame_time)
+                    if frame is not None:
+                        try:
+                            frame, seq = self.publish_frame(i, frame, last_frame_time)
+                            tracer = self.tracer
+                            traced = tracer is not None and tracer.sampled(seq)
+                            if traced:
+                                camera_name = self.camera_names[i]
+                                tracer.add("grab", camera_name, grab_start, grab_end, seq)
+                                tracer.add("decode", camera_name, decode_start, decode_end, seq)
+                            if analyse:
+                                stage_start = time.perf_counter()
+                                self.motion_checks[i] = last_frame_time
+                                self.detect_motion(i, frame, last_frame_time)
+                                if traced:
+                                    tracer.add("motion", camera_name, stage_start, seq=seq)
+                            if record:
+                                stage_start = time.perf_counter()
+                                self.write_frame(i, frame, last_frame_time, seq)
+                                if traced:
+                                    tracer.add("queue", camera_name, stage_start, seq=seq)
+                            if thumbnail:
+                                stage_start = time.perf_counter()
+                                self.sample_thumbnail(i, frame, last_frame_time)
+                                if traced:
+                                    tracer.add("thumbnail", camera_name, stage_start, seq=seq)
+                            for listener, _, last_times, _ in listeners:
+                                last_times[i] = last_frame_time
+                                listener(i, frame, last_frame_time, seq)
+                        finally:
+                            # The capture thread's own reference
+                            self.release_frame(i, frame)
+                    if status != "connected":
+                        status = "connected"
+                        self.notify_status(i, status)
+                elif time.time() - last_frame_time > self.connections.read_timeout:
+                    self.handle_disconnection(i)
+            except Exception as e:
+                self.log_error(str(e), i)
+                time.sleep(1)
+
+        if generation != self.stream_generations[i] and capture is not None:
+            capture.release()
+
+    def rollover_chunk(self, i):
+        # Swaps in the pre-opened writer at a frame boundary and leaves draining
+        # and releasing the old one to the chunk executor
+        rollover_start = time.perf_counter()
+        self.schedule_next_chunk(i)
+        future, self.next_chunks[i] = self.next_chunks[i], None
+        writer, index = future.result()
+        old_writer = self.video_writers[i]
+        self.chunk_indices[i] = index
+        self.activate_chunk(i, writer)
+        self.submit_finalizer(i, old_writer)
+        self.metrics.rollover[i].observe(time.perf_counter() - rollover_start)
+        if self.tracer is not None:
+            self.tracer.add("rollover", self.camera_names[i], rollover_start)
+
+    def submit_finalizer(self, i, writer):
+        finalizer = self.chunk_executor.submit(self.finalize_chunk, i, writer, time.time())
+        self.finalizing_chunks.add(finalizer)
+        finalizer.add_done_callback(self.finalizing_chunks.discard)
+
+    def sample_thumbnail(self, i, frame, timestamp):
+        writer = self.video_writers[i]
+        if writer is not None:
+            self.thumbnail_times[i] = timestamp
+            self.thumbnails.add(writer.filename, frame, timestamp)
+
+    def check_chunk_boundary(self, i, can_split=True):
+        elapsed = datetime.now() - self.chunk_start_times[i]
+        if elapsed >= self.chunk_duration - self.preopen_lead:
+            self.schedule_next_chunk(i)
+        if can_split and elapsed >= self.chunk_duration:
+            self.rollover_chunk(i)
+
+    def write_packet(self, i, packet):
+        # Called from the capture thread for every demuxed packet in copy mode.
+        # Chunks are only cut on keyframes so every segment is decodable on its own.
+        with self.writer_locks[i]:
+            if not self.recording or not self.camera_connected[i]:
+                return
+            if self.record_trigger == "motion" and not self.gate_motion(i, packet, time.time(), packet.is_keyframe):
+                return
+            if self.video_writers[i] is None:
+                self.take_replacement_chunk(i)
+            if self.video_writers[i] is None:
+                return
+            self.check_chunk_boundary(i, can_split=packet.is_keyframe)
+            self.video_writers[i].write(packet)
+
+    def write_frame(self, i, frame, timestamp, seq=None):
+        # Called from the capture thread with the time the frame was read
+        if self.record_mode == "copy":
+            return
+        with self.writer_locks[i]:
+            if not self.recording or not self.camera_connected[i]:
+                return
+            if self.record_trigger == "motion" and not self.gate_motion(i, (frame, timestamp, seq), timestamp):
+                return
+            if self.video_writers[i] is None:
+                self.take_replacement_chunk(i)
+            if self.video_writers[i] is None:
+                return
+            self.check_chunk_boundary(i)
+            self.video_writers[i].write(frame, timestamp, seq)
+
+    def detect_motion(self, i, frame, timestamp):
+        if self.motion_detectors[i].update(frame):
+            self.motion_until[i] = timestamp + self.post_roll
+
+    def gate_motion(self, i, item, timestamp, keyframe=True):
+        # Decides whether item (a packet, or a (frame, timestamp, seq) tuple) goes
+        # to the open chunk now. Opens a chunk when motion starts and closes it
+        # once the post-roll has run out; in between items wait in the pre-roll.
+        pre_roll = self.pre_rolls[i]
+        if timestamp < self.motion_until[i]:
+            if self.video_writers[i] is None:
+                self.chunk_start_times[i] = datetime.now()
+                self.start_new_chunk(i, pre_roll[0][0] if pre_roll else None)
+                for _, items in pre_roll:
+                    for queued in items:
+                        self.write_item(i, queued)
+                self.clear_pre_roll(i)
+            return True
+        if self.video_writers[i] is not None:
+            self.close_chunk(i, background=True)
+        # The pre-roll is kept as groups starting on a keyframe so it can always
+        # be replayed into a decodable segment; decoded frames are one per group.
+        if keyframe:
+            pre_roll.append((timestamp, []))
+        elif not pre_roll:
+            return False
+        if self.record_mode != "copy":
+            self.retain_frame(i, item[0])
+        pre_roll[-1][1].append(item)
+        while len(pre_roll) > 1 and pre_roll[1][0] <= timestamp - self.pre_roll:
+            self.release_items(i, pre_roll.popleft()[1])
+        return False
+
+    def release_items(self, i, items):
+        if self.record_mode != "copy":
+            for frame, _, _ in items:
+                self.release_frame(i, frame)
+
+    def clear_pre_roll(self, i):
+        for _, items in self.pre_rolls[i]:
+            self.release_items(i, items)
+        self.pre_rolls[i].clear()
+
+    def write_item(self, i, item):
+        if self.record_mode == "copy":
+            self.video_writers[i].write(item)
+        else:
+            self.video_writers[i].write(*item)
+
+    def start_recording(self):
+        if self.recording:
+            return
+        for i in range(len(self.captures)):
+            with self.writer_locks[i]:
+                if self.camera_connected[i] and self.record_trigger == "continuous":
+                    self.chunk_start_times[i] = datetime.now()
+                    self.start_new_chunk(i)
         self.recording = True
-        while self.recording:
-            current_time = datetime.now()
-            for i, frame in enumerate(self.frames):
-                if frame is not None and self.camera_connected[i]:
-                    elapsed_time = current_time - self.chunk_start_times[i]
-                    if elapsed_time >= self.chunk_duration:
-                        self.video_writers[i].stop()
-                        camera_name = "front" if i == 0 else "rear"
-                        self.logger.log_file_save(camera_name, os.path.basename(self.video_writers[i].filename))
-                        self.chunk_indices[i] += 1
-                        self.start_new_chunk(i)
-                    self.video_writers[i].write(frame)
-
-            cv2.waitKey(1)
-
-        for writer in self.video_writers:
-            if writer is not None:
-                writer.stop()
-        self.logger.log_recording_stop()
 
     def stop_recording(self):
+        if not self.recording:
+            return
         self.recording = False
+        for i in range(len(self.captures)):
+            with self.writer_locks[i]:
+                self.close_chunk(i)
+                self.clear_pre_roll(i)
+        wait(list(self.finalizing_chunks))
+        self.logger.log_recording_stop()
+
+    def finalize_chunk(self, i, writer, end_time):
+        finalize_start = time.perf_counter()
+        try:
+            if not writer.stop(stallTimeout=self.writer_stall_timeout()):
+                # Stuck while draining, or died: left behind like a writer the
+                # watchdog abandons, so it cannot use up the chunk executor. The
+                # segment stays marked as recording for recovery to salvage.
+                self.metrics.writer_abandoned(i, writer)
+                if self.thumbnails is not None:
+                    self.thumbnails.finish(writer.filename)
+                if writer.error is not None:
+                    self.logger.log_stage_error("writer", self.camera_names[i], str(writer.error))
+                else:
+                    self.logger.log_stage_stalled("finalize", self.camera_names[i], time.perf_counter() - finalize_start)
+                return
+        except OSError as e:
+            # The staged segment could not be copied to disk; it stays in the
+            # staging area, still marked as recording, for recovery to salvage
+            self.log_error(f"Cannot save {os.path.basename(writer.filename)}: {str(e)}", i)
+            return
+        size = os.path.getsize(writer.filename) if os.path.exists(writer.filename) else 0
+        self.catalog.close_segment(writer.filename, end_time, writer.stats['written'], size)
+        if self.thumbnails is not None:
+            future = self.thumbnails.finish(writer.filename)
+            if future is not None:
+                future.add_done_callback(
+                    lambda future, i=i, path=writer.filename: self.thumbnails_written(i, path, future))
+        self.metrics.writer_finished(i, writer, size, time.perf_counter() - finalize_start)
+        if self.tracer is not None:
+            self.tracer.add("finalize", self.camera_names[i], finalize_start)
+        self.logger.log_file_save(self.camera_names[i], os.path.basename(writer.filename), writer.stats)
+        self.notify_chunk(i, "chunk_saved", writer.filename)
+
+    def thumbnails_written(self, i, path, future):
+        # Runs on the thumbnail thread once the sidecars of a saved segment are
+        # on disk, so retention can count them too
+        if future.exception() is not None:
+            self.log_error(f"Cannot write thumbnails for {os.path.basename(path)}: {str(future.exception())}", i)
+            return
+        if future.result():
+            self.catalog.set_thumbnail_bytes(path, future.result())
+            self.notify_chunk(i, "thumbnails_saved", path)
+
+    def close_chunk(self, i, background=False):
+        writer, self.video_writers[i] = self.video_writers[i], None
+        if writer is not None:
+            if background:
+                self.submit_finalizer(i, writer)
+            else:
+                self.finalize_chunk(i, writer, time.time())
+        for chunks in (self.next_chunks, self.replacement_chunks):
+            if chunks[i] is not None:
+                chunks[i].add_done_callback(self.discard_next_chunk)
+                chunks[i] = None
 
     def release(self):
         for capture in self.captures:
-            capture.release()
+            if capture is not None:
+                capture.release()
+        for ring in self.frame_rings:
+            if ring is not None:
+                ring.close()
+        self.chunk_executor.shutdown(wait=True)
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+        if self.stager is not None:
+            self.stager.close()
+        self.catalog.close()
+        for lock_file in self.camera_locks:
+            lock_file.close()
+
+    def collect_metrics(self):
+        families = self.metrics.collect(self.connections)
+        if self.stager is not None:
+            families += self.stager.collect()
+        return families
 
     def log_error(self, error_message, camera_index=None):
-        camera_name = f"Camera {camera_index + 1}" if camera_index is not None else "Unknown camera"
+        camera_name = self.camera_names[camera_index] if camera_index is not None else "Unknown camera"
         self.logger.log_error(error_message, camera_name)
 
     def handle_disconnection(self, camera_index):
-        camera_name = "front" if camera_index == 0 else "rear"
-        self.logger.log_camera_disconnect(f"Camera {camera_index + 1}")
+        self.logger.log_camera_disconnect(self.camera_names[camera_index])
+        self.connections.mark_disconnected(camera_index)
 
-        self.camera_connected[camera_index] = False
+        with self.writer_locks[camera_index]:
+            self.camera_connected[camera_index] = False
 
-        # Stop the current recording for this camera
-        if self.video_writers[camera_index] is not None:
-            self.video_writers[camera_index].stop()
-            self.logger.log_file_save(camera_name, os.path.basename(self.video_writers[camera_index].filename))
-            self.video_writers[camera_index] = None
+            # Stop the current recording for this camera
+            self.close_chunk(camera_index)
+            self.clear_pre_roll(camera_index)
+            self.motion_detectors[camera_index].reset()
 
     def handle_reconnection(self, camera_index):
-        camera_name = "front" if camera_index == 0 else "rear"
-        self.logger.log_camera_connect(f"Camera {camera_index + 1}")
+        self.logger.log_camera_connect(self.camera_names[camera_index], self.connections.last_downtime(camera_index))
+        # A camera that was down at startup, or comes back with another size,
+        # gets its pool before the chunk whose writer retains frames in it
+        capture = self.captures[camera_index]
+        width, height = int(capture.get(3)), int(capture.get(4))
+        pool = self.frame_pools[camera_index]
+        if (width and height and not self.ring_slots and self.frame_pool_size != 0
+                and (pool is None or pool.shape != (height, width, 3))):
+            self.setup_frame_pool(camera_index, (height, width, 3))
 
-        self.camera_connected[camera_index] = True
+        with self.writer_locks[camera_index]:
+            self.camera_connected[camera_index] = True
 
-        # Start a new recording chunk for this camera
-        self.chunk_start_times[camera_index] = datetime.now()
-        self.start_new_chunk(camera_index)
+            # Start a new recording chunk for this camera
+            if self.recording and self.record_trigger == "continuous":
+                self.chunk_start_times[camera_index] = datetime.now()
+                self.start_new_chunk(camera_index)
 
-    def attempt_reconnection(self, camera_index):
-        self.logger.log_reconnection_attempt(f"Camera {camera_index + 1}")
-        self.captures[camera_index].release()
-        self.captures[camera_index] = cv2.VideoCapture(self.camera_urls[camera_index], cv2.CAP_FFMPEG)
-        if self.captures[camera_index].isOpened():
+    def attempt_reconnection(self, camera_index, generation=None):
+        self.logger.log_reconnection_attempt(self.camera_names[camera_index])
+        if self.captures[camera_index] is not None:
+            self.captures[camera_index].release()
+            self.captures[camera_index] = None
+        capture = self.connect_capture(camera_index)
+        if generation is not None and generation != self.stream_generations[camera_index]:
+            # The watchdog replaced this thread while it was opening
+            capture.release()
+            return False
+        self.captures[camera_index] = capture
+        if capture.isOpened():
             self.handle_reconnection(camera_index)
             return True
         return False
\ No newline at end of file
@@ -0,0 +1,142 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from logger import Logger, configure_logging, listen_for_logs
+from camera_manager import CameraManager, default_camera_name
+from metrics import merge_families
+
+def run_worker(camera_urls, camera_names, manager_options, events, stop_event, log_queue, metrics_interval=5):
+    # Entry point of a worker process: records its shard of cameras headless and
+    # reports status and chunk events, and every metrics_interval seconds its
+    # metrics, back to the supervisor. Log records go to the supervisor too, so
+    # only one process writes (and rotates) the log files. Ctrl+C is left to
+    # the supervisor so shutdown always goes through stop_event.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_logging(log_queue=log_queue)
+    camera_manager = CameraManager(camera_urls, camera_names=camera_names, require_connection=False, **manager_options)
+    camera_manager.add_status_listener(
+        lambda i, status: events.put({'camera': camera_names[i], 'event': 'status', 'status': status, 'time': time.time()}))
+    camera_manager.add_chunk_listener(
+        lambda i, event, path: events.put({'camera': camera_names[i], 'event': event, 'path': path, 'time': time.time()}))
+
+    camera_manager.start_stream_threads()
+    camera_manager.start_recording()
+    worker_name = multiprocessing.current_process().name
+    while not stop_event.wait(metrics_interval):
+        events.put({'event': 'metrics', 'worker': worker_name, 'families': camera_manager.collect_metrics(),
+                    'time': time.time()})
+
+    camera_manager.stop_recording()
+    camera_manager.stop_stream_threads(timeout=camera_manager.connections.open_timeout)
+    camera_manager.release()
+
+class CameraSupervisor:
+    # Extra keyword arguments (record_mode, container, ring_slots, ...) are
+    # passed on to the CameraManager of every worker.
+    def __init__(self, camera_urls, camera_names=None, num_workers=None, restart_delay=5, **manager_options):
+        self.camera_urls = camera_urls
+        self.camera_names = camera_names or [default_camera_name(i) for i in range(len(camera_urls))]
+        self.num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(camera_urls)))
+        self.manager_options = manager_options
+        self.restart_delay = restart_delay
+        self.logger = Logger()
+
+        # Round-robin so neighbouring cameras (usually similar streams) land on different cores
+        self.shards = [list(range(w, len(camera_urls), self.num_workers)) for w in range(self.num_workers)]
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.log_queue = self.context.Queue()
+        self.log_listener = None
+        self.workers = [None] * self.num_workers
+        self.restart_times = [0] * self.num_workers
+        self.camera_status = {name: "starting" for name in self.camera_names}
+        self.worker_metrics = {}  # Latest metrics reported by each worker
+        self.event_listeners = []
+        self.monitor_thread = None
+
+    def add_event_listener(self, listener):
+        # listener(event) gets every status/chunk event dict reported by the workers
+        self.event_listeners.append(listener)
+
+    def worker_options(self, w):
+        # The staging limit is for the whole recorder, every worker stages
+        # into its own share of it in proportion to its cameras
+        options = dict(self.manager_options)
+        if options.get('staging_limit'):
+            options['staging_limit'] = options['staging_limit'] * len(self.shards[w]) // len(self.camera_urls)
+        return options
+
+    def spawn_worker(self, w):
+        shard = self.shards[w]
+        process = self.context.Process(
+            target=run_worker,
+            args=([self.camera_urls[i] for i in shard], [self.camera_names[i] for i in shard],
+                  self.worker_options(w), self.events, self.stop_event, self.log_queue),
+            name=f"camera-worker-{w}",
+            daemon=True)
+        process.start()
+        self.workers[w] = process
+
+    def start(self):
+        self.log_listener = listen_for_logs(self.log_queue)
+        for w in range(self.num_workers):
+            self.spawn_worker(w)
+        self.monitor_thread = threading.Thread(target=self.monitor, daemon=True)
+        self.monitor_thread.start()
+
+    def monitor(self):
+        while not self.stop_event.is_set():
+            self.drain_events(timeout=1)
+            self.check_workers()
+
+    def drain_events(self, timeout=0):
+        try:
+            event = self.events.get(timeout=timeout)
+            while True:
+                if event['event'] == 'status':
+                    self.camera_status[event['camera']] = event['status']
+                elif event['event'] == 'metrics':
+                    self.worker_metrics[event['worker']] = event['families']
+                for listener in self.event_listeners:
+                    listener(event)
+                event = self.events.get_nowait()
+        except queue.Empty:
+            pass
+
+    def collect_metrics(self):
+        return merge_families(list(self.worker_metrics.values()))
+
+    def check_workers(self):
+        now = time.time()
+        for w, process in enumerate(self.workers):
+            if process.is_alive() or self.stop_event.is_set():
+                continue
+            if not self.restart_times[w]:
+                self.logger.log_worker_exit(process.name, process.exitcode)
+                for i in self.shards[w]:
+                    self.camera_status[self.camera_names[i]] = "restarting"
+                self.restart_times[w] = now + self.restart_delay
+            elif now >= self.restart_times[w]:
+                self.restart_times[w] = 0
+                self.spawn_worker(w)
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        if self.monitor_thread:
+            self.monitor_thread.join()
+        # Keep reading events while the workers finalize their last chunks, a
+        # worker cannot exit until its queued events have been consumed.
+        deadline = time.time() + timeout
+        while any(p is not None and p.is_alive() for p in self.workers) and time.time() < deadline:
+            self.drain_events(timeout=0.1)
+        for process in self.workers:
+            if process is not None and process.is_alive():
+                process.terminate()
+        self.drain_events()
+        if self.log_listener:
+            self.log_listener.stop()
+            self.log_listener = None
@@ -0,0 +1,174 @@
+import argparse
+import os
+import av
+from datetime import datetime
+from fractions import Fraction
+from recording_catalog import RecordingCatalog, partial_path
+
+CLIP_TIME_BASE = Fraction(1, 1000)
+
+def export_clip(catalog, camera, start, end, output_path):
+    # Writes the [start, end) wall-clock range of a camera into one file. When
+    # every segment in the range has the same codec and frame size the packets
+    # are copied as they are; the clip then starts on the keyframe at or before
+    # start. Otherwise the frames are re-encoded as MJPEG.
+    start_time, end_time = start.timestamp(), end.timestamp()
+    segments = catalog.find_segments(camera, start_time, end_time)
+    if not segments:
+        raise ValueError(f"No recordings for camera {camera} between {start} and {end}")
+
+    layouts = set()
+    for segment in segments:
+        with av.open(segment_file(catalog, segment)) as container:
+            context = container.streams.video[0].codec_context
+            layouts.add((context.name, context.width, context.height))
+    stream_copy = len(layouts) == 1
+
+    with av.open(segment_file(catalog, segments[0])) as first:
+        template = first.streams.video[0]
+        output = av.open(output_path, 'w')
+        if stream_copy:
+            out_stream = output.add_stream_from_template(template)
+        else:
+            out_stream = output.add_stream('mjpeg')
+            out_stream.width = template.codec_context.width
+            out_stream.height = template.codec_context.height
+            out_stream.pix_fmt = 'yuvj420p'
+            out_stream.codec_context.time_base = CLIP_TIME_BASE
+
+    clip = ClipTimeline(out_stream)
+    try:
+        for segment in segments:
+            with av.open(segment_file(catalog, segment)) as container:
+                if stream_copy:
+                    copy_segment(container, segment['start_time'], start_time, end_time, clip, output)
+                else:
+                    transcode_segment(container, segment['start_time'], start_time, end_time, clip, output)
+        if not stream_copy:
+            for packet in out_stream.encode():
+                output.mux(packet)
+    finally:
+        output.close()
+    return {'segments': len(segments), 'frames': clip.frames, 'stream_copy': stream_copy}
+
+def segment_file(catalog, segment):
+    # A segment still being recorded only exists under its partial name
+    path = catalog.resolve(segment['path'])
+    if segment['status'] == 'recording' and not os.path.exists(path):
+        return partial_path(path)
+    return path
+
+class ClipTimeline:
+    # Maps segment wall-clock times onto the clip's millisecond timeline and
+    # keeps timestamps strictly increasing across segment joins
+    def __init__(self, stream):
+        self.stream = stream
+        self.base = None
+        self.last_dts = -1
+        self.frames = 0
+
+    def to_clip(self, wall_time):
+        return int(round((wall_time - self.base) * 1000))
+
+def seek_to_start(container, stream, segment_start, start_time):
+    # A segment that begins before start_time is entered at the keyframe at
+    # or before start_time instead of being demuxed from its beginning
+    if stream.start_time is None or start_time <= segment_start:
+        return
+    target = stream.start_time + int((start_time - segment_start) / stream.time_base)
+    try:
+        container.seek(target, stream=stream, backward=True, any_frame=False)
+    except av.FFmpegError:
+        container.seek(stream.start_time, stream=stream)  # No index to seek with, read it all
+
+def copy_segment(container, segment_start, start_time, end_time, clip, output):
+    stream = container.streams.video[0]
+    # The segment's start_time in the catalog is the capture time of its first frame
+    offset = stream.start_time
+    seek_to_start(container, stream, segment_start, start_time)
+    gop = []  # Packets since the last keyframe before start_time
+    for packet in container.demux(stream):
+        if packet.size == 0:
+            continue
+        if packet.dts is None:
+            # Matroska leaves dts unset on packets that come before any reordering
+            packet.dts = packet.pts
+        if offset is None:
+            offset = packet.pts
+        wall_dts = segment_start + float((packet.dts - offset) * packet.time_base)
+        # Cutting in decode order keeps every reference frame a kept frame needs,
+        # so with B-frames the clip can run a frame or two past end_time
+        if wall_dts >= end_time:
+            break
+        if wall_dts < start_time:
+            if packet.is_keyframe:
+                gop = []
+            gop.append(packet)
+            continue
+        for queued in gop + [packet]:
+            mux_packet(queued, segment_start, offset, clip, output)
+        gop = []
+
+def mux_packet(packet, segment_start, offset, clip, output):
+    wall_dts = segment_start + float((packet.dts - offset) * packet.time_base)
+    wall_pts = segment_start + float((packet.pts - offset) * packet.time_base)
+    if clip.base is None:
+        if not packet.is_keyframe:
+            return
+        clip.base = wall_pts
+    dts = max(clip.to_clip(wall_dts), clip.last_dts + 1)
+    out = av.Packet(bytes(packet))
+    out.dts = dts
+    out.pts = max(clip.to_clip(wall_pts), dts)
+    out.time_base = CLIP_TIME_BASE
+    out.is_keyframe = packet.is_keyframe
+    out.stream = clip.stream
+    output.mux(out)
+    clip.last_dts = dts
+    clip.frames += 1
+
+def transcode_segment(container, segment_start, start_time, end_time, clip, output):
+    stream = container.streams.video[0]
+    stream.codec_context.thread_type = 'AUTO'
+    offset = stream.start_time
+    seek_to_start(container, stream, segment_start, start_time)
+    for frame in container.decode(stream):
+        if frame.pts is None:
+            continue
+        if offset is None:
+            offset = frame.pts
+        wall_time = segment_start + float((frame.pts - offset) * frame.time_base)
+        if wall_time >= end_time:
+            break
+        if wall_time < start_time:
+            continue
+        if clip.base is None:
+            clip.base = wall_time
+        pts = max(clip.to_clip(wall_time), clip.last_dts + 1)
+        frame.pts = pts
+        frame.time_base = CLIP_TIME_BASE
+        for packet in clip.stream.encode(frame):
+            output.mux(packet)
+        clip.last_dts = pts
+        clip.frames += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a time range of one camera into a single clip")
+    parser.add_argument('camera', help="Camera name as used in the file names, e.g. front")
+    parser.add_argument('start', type=datetime.fromisoformat, help="Start of the range, e.g. 2024-08-28T14:00:00")
+    parser.add_argument('end', type=datetime.fromisoformat, help="End of the range (exclusive)")
+    parser.add_argument('-o', '--output', help="Output file, defaults to <camera>_<start>_<end>.mkv")
+    parser.add_argument('--recordings', default=os.path.join(os.getcwd(), "recordings"))
+    args = parser.parse_args()
+
+    output_path = args.output or f"{args.camera}_{args.start.strftime('%Y%m%d_%H%M%S')}_{args.end.strftime('%Y%m%d_%H%M%S')}.mkv"
+    catalog = RecordingCatalog(args.recordings)
+    try:
+        result = export_clip(catalog, args.camera, args.start, args.end, output_path)
+    finally:
+        catalog.close()
+    mode = "stream copy" if result['stream_copy'] else "re-encoded"
+    print(f"Wrote {output_path}: {result['frames']} frames from {result['segments']} segments ({mode})")
+
+if __name__ == "__main__":
+    main()
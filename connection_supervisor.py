@@ -0,0 +1,107 @@
+import cv2
+import random
+import threading
+import time
+
+class ConnectionSupervisor:
+    # Reconnection policy and connection state of every camera. The capture
+    # threads do the opening themselves, each on its own thread, so cameras
+    # never wait for each other; at most max_concurrent_opens opens run at
+    # once so a whole rack coming back does not hit the network in one go.
+    # Retries back off exponentially from base_delay up to max_delay with
+    # random jitter, so cameras dropped together do not retry in lockstep.
+    def __init__(self, camera_names, open_timeout=10.0, read_timeout=5.0, base_delay=0.5, max_delay=30.0,
+                 max_concurrent_opens=8):
+        self.camera_names = camera_names
+        self.open_timeout = open_timeout  # Seconds an open may take before it counts as failed
+        self.read_timeout = read_timeout  # Seconds without a frame before a camera counts as disconnected
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_concurrent_opens = max_concurrent_opens
+        self.open_slots = threading.BoundedSemaphore(max_concurrent_opens)
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        # state is "connecting", "connected" or "backoff"; failures counts the
+        # failed opens since the camera was last connected
+        self.states = [{'state': "connecting", 'attempts': 0, 'failures': 0, 'outages': 0, 'connected_since': None,
+                        'disconnected_at': None, 'last_downtime': None, 'next_attempt': None, 'last_error': None}
+                       for _ in camera_names]
+
+    def capture_params(self):
+        # Open parameters for cv2.VideoCapture with the FFmpeg backend
+        return [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(self.open_timeout * 1000),
+                cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(self.read_timeout * 1000)]
+
+    def av_timeout(self):
+        # timeout argument of av.open
+        return (self.open_timeout, self.read_timeout)
+
+    def open(self, i, opener):
+        # opener() returns a capture; its isOpened() decides success
+        with self.open_slots:
+            with self.lock:
+                self.states[i]['state'] = "connecting"
+                self.states[i]['attempts'] += 1
+                self.states[i]['next_attempt'] = None
+            capture = opener()
+        if capture.isOpened():
+            self.mark_connected(i)
+        else:
+            self.mark_failed(i, "open failed")
+        return capture
+
+    def mark_connected(self, i):
+        now = time.time()
+        with self.lock:
+            state = self.states[i]
+            state['state'] = "connected"
+            state['failures'] = 0
+            state['connected_since'] = now
+            if state['disconnected_at'] is not None:
+                state['last_downtime'] = now - state['disconnected_at']
+                state['disconnected_at'] = None
+
+    def mark_failed(self, i, error):
+        with self.lock:
+            state = self.states[i]
+            state['state'] = "backoff"
+            state['failures'] += 1
+            state['last_error'] = error
+            if state['disconnected_at'] is None:
+                state['disconnected_at'] = time.time()
+
+    def mark_disconnected(self, i, error="no frames"):
+        with self.lock:
+            state = self.states[i]
+            if state['state'] == "connected":
+                state['outages'] += 1
+                state['disconnected_at'] = time.time()
+            state['state'] = "backoff"
+            state['last_error'] = error
+            state['connected_since'] = None
+
+    def last_downtime(self, i):
+        with self.lock:
+            return self.states[i]['last_downtime']
+
+    def backoff_delay(self, i):
+        with self.lock:
+            failures = self.states[i]['failures']
+        return min(self.max_delay, self.base_delay * 2 ** failures) * random.uniform(0.5, 1.0)
+
+    def wait_before_retry(self, i):
+        # Returns False if stop() was called while waiting
+        delay = self.backoff_delay(i)
+        with self.lock:
+            self.states[i]['next_attempt'] = time.time() + delay
+        return not self.stop_event.wait(delay)
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(state) for name, state in zip(self.camera_names, self.states)}
+
+    def start(self):
+        self.stop_event.clear()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,54 @@
+import threading
+import numpy as np
+
+class FramePool:
+    # Set of BGR frames for one camera, reused instead of allocated per frame.
+    # The capture thread takes a frame with acquire() (holding the first
+    # reference) and decodes into it; anyone who keeps the frame after the call
+    # that handed it over (writer queue, pre-roll, live view) takes a reference
+    # with retain() and gives it back with release(). A frame returns to the
+    # pool when its last reference is released. Frames are only allocated when
+    # none is free, so the memory held is the most frames ever in flight at
+    # once; once size frames exist acquire() returns None and the caller skips
+    # that frame, so size bounds the memory decoded frames can take.
+    def __init__(self, shape, size):
+        self.shape = shape
+        self.size = size
+        self.lock = threading.Lock()
+        self.buffers = []  # Every frame allocated, keeps the ids in refs stable
+        self.refs = {}
+        self.free = []
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                buffer = self.free.pop()
+            elif len(self.buffers) < self.size:
+                buffer = np.empty(self.shape, dtype=np.uint8)
+                self.buffers.append(buffer)
+            else:
+                return None
+            self.refs[id(buffer)] = 1
+            return buffer
+
+    # Frames that do not belong to the pool are ignored by retain and release,
+    # so consumers can call them on whatever frame they were given
+    def retain(self, frame):
+        with self.lock:
+            key = id(frame)
+            if self.refs.get(key):
+                self.refs[key] += 1
+
+    def release(self, frame):
+        with self.lock:
+            key = id(frame)
+            count = self.refs.get(key)
+            if not count:
+                return
+            self.refs[key] = count - 1
+            if count == 1:
+                self.free.append(frame)
+
+    def in_use(self):
+        with self.lock:
+            return len(self.buffers) - len(self.free)
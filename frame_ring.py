@@ -0,0 +1,117 @@
+import os
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+HEADER_FIELDS = 8  # write_seq, slots, height, width, channels, owner pid, reserved...
+HEADER_SIZE = HEADER_FIELDS * 8
+
+class FrameRing:
+    # Fixed ring of preallocated BGR frame slots in shared memory. The capture
+    # thread is the only writer; the recorder, the preview and other processes
+    # read slots in place. Every slot carries the sequence number of the frame
+    # it holds, so a reader can tell when a slot it is using got overwritten:
+    # take the view, use it, then check is_valid(seq).
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        self.slots = int(self.header[1])
+        self.shape = (int(self.header[2]), int(self.header[3]), int(self.header[4]))
+        self.seqs = np.ndarray((self.slots,), dtype=np.int64, buffer=shm.buf, offset=HEADER_SIZE)
+        self.timestamps = np.ndarray((self.slots,), dtype=np.float64, buffer=shm.buf, offset=HEADER_SIZE + self.slots * 8)
+        self.frames = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=HEADER_SIZE + self.slots * 16)
+        # One view object per slot, so a frame read into a slot can be recognized by identity
+        self.slot_views = [self.frames[k] for k in range(self.slots)]
+
+    @classmethod
+    def create(cls, name, shape, slots=8):
+        height, width, channels = shape
+        size = HEADER_SIZE + slots * 16 + slots * height * width * channels
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Only a ring whose recorder is gone (killed before it could unlink
+            # it) is replaced; a live recorder with the same camera name keeps its own
+            existing = shared_memory.SharedMemory(name=name)
+            owner_pid = int(np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=existing.buf)[5]) \
+                if existing.size >= HEADER_SIZE else 0
+            existing.close()
+            if process_alive(owner_pid):
+                raise FileExistsError(f"Frame ring {name} is in use by process {owner_pid}")
+            existing.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = (0, slots, height, width, channels, os.getpid(), 0, 0)
+        ring = cls(shm, owner=True)
+        ring.seqs[:] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # The creator owns the segment; without this the resource tracker of a
+        # reader process would unlink it when the reader exits.
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    def next_slot(self):
+        # Hands out the slot for the next frame so the capture can decode straight
+        # into shared memory. The slot is invalidated until commit() is called.
+        seq = int(self.header[0]) + 1
+        slot = seq % self.slots
+        self.seqs[slot] = -1
+        return seq, self.slot_views[slot]
+
+    def commit(self, seq, timestamp):
+        slot = seq % self.slots
+        self.timestamps[slot] = timestamp
+        self.seqs[slot] = seq
+        self.header[0] = seq
+
+    def write(self, frame, timestamp):
+        seq, slot = self.next_slot()
+        slot[...] = frame
+        self.commit(seq, timestamp)
+        return seq, slot
+
+    def latest_seq(self):
+        return int(self.header[0])
+
+    def get(self, seq):
+        # Returns (frame view, timestamp) or None if the slot no longer holds seq
+        slot = seq % self.slots
+        if seq <= 0 or self.seqs[slot] != seq:
+            return None
+        return self.slot_views[slot], float(self.timestamps[slot])
+
+    def latest(self):
+        seq = self.latest_seq()
+        entry = self.get(seq)
+        if entry is None:
+            return None
+        return (seq,) + entry
+
+    def is_valid(self, seq):
+        return seq > 0 and self.seqs[seq % self.slots] == seq
+
+    def close(self):
+        self.header = self.seqs = self.timestamps = self.frames = self.slot_views = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Consumers still hold views, the mapping goes away with the last of them
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+def process_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by another user
+    return True
@@ -0,0 +1,197 @@
+import html
+import threading
+import cv2
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+BOUNDARY = "frame"
+
+class LiveServer:
+    # Republishes the cameras of a CameraManager over HTTP as MJPEG, so
+    # viewers never open RTSP sessions of their own:
+    #   /                      list of cameras
+    #   /live/<camera>.mjpg    multipart MJPEG stream
+    #   /live/<camera>.jpg     latest frame
+    # A camera is only decoded for viewing while someone watches it, at most
+    # fps frames a second. Each frame is encoded once, on a per-camera encoder
+    # thread, and the same JPEG goes to every client; a slow client skips to
+    # the newest frame instead of queueing.
+    def __init__(self, camera_manager, host="127.0.0.1", port=8090, fps=10, quality=80, width=None):
+        self.camera_manager = camera_manager
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.quality = quality
+        self.width = width  # Scale frames down to this width before encoding
+        num_cameras = len(camera_manager.camera_names)
+        self.conditions = [threading.Condition() for _ in range(num_cameras)]
+        self.frames = [None] * num_cameras  # Newest frame not yet encoded
+        self.jpegs = [(0, None)] * num_cameras  # (sequence, JPEG bytes) sent to clients
+        self.viewers = [0] * num_cameras
+        self.listeners = [self.frame_listener(i) for i in range(num_cameras)]
+        self.viewer_lock = threading.Lock()
+        self.running = False
+        self.server = None
+        self.threads = []
+
+    def frame_listener(self, i):
+        def listener(camera_index, frame, timestamp, seq):
+            # Capture thread: only takes a reference to the pooled frame (a copy
+            # when it is a ring slot) and wakes the encoder
+            if self.width and frame.shape[1] > self.width:
+                height = round(frame.shape[0] * self.width / frame.shape[1])
+                frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_LINEAR)
+            elif self.camera_manager.ring_slots:
+                frame = frame.copy()
+            else:
+                self.camera_manager.retain_frame(i, frame)
+            with self.conditions[i]:
+                replaced, self.frames[i] = self.frames[i], frame
+                self.conditions[i].notify_all()
+            if replaced is not None:
+                self.camera_manager.release_frame(i, replaced)
+        return listener
+
+    def encode_frames(self, i):
+        condition = self.conditions[i]
+        while self.running:
+            with condition:
+                while self.running and self.frames[i] is None:
+                    condition.wait()
+                frame, self.frames[i] = self.frames[i], None
+            if frame is None:
+                continue
+            ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            self.camera_manager.release_frame(i, frame)
+            if not ok:
+                continue
+            with condition:
+                self.jpegs[i] = (self.jpegs[i][0] + 1, data.tobytes())
+                condition.notify_all()
+
+    def add_viewer(self, i):
+        with self.viewer_lock:
+            self.viewers[i] += 1
+            if self.viewers[i] == 1:
+                self.camera_manager.add_frame_listener(self.listeners[i], max_fps=self.fps, cameras=[i])
+
+    def remove_viewer(self, i):
+        with self.viewer_lock:
+            self.viewers[i] -= 1
+            if self.viewers[i] == 0:
+                self.camera_manager.remove_frame_listener(self.listeners[i])
+
+    def next_jpeg(self, i, last_seq, timeout=5.0):
+        # Blocks until a JPEG newer than last_seq is there; None on timeout or shutdown
+        condition = self.conditions[i]
+        with condition:
+            condition.wait_for(lambda: not self.running or self.jpegs[i][0] > last_seq, timeout)
+            seq, data = self.jpegs[i]
+        if not self.running or seq <= last_seq:
+            return None
+        return seq, data
+
+    def camera_index(self, name):
+        try:
+            return self.camera_manager.camera_names.index(name)
+        except ValueError:
+            return None
+
+    def start(self):
+        live = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = unquote(self.path.split('?')[0])
+                if path == "/":
+                    self.send_index()
+                    return
+                name, _, extension = path[len("/live/"):].rpartition('.')
+                i = live.camera_index(name) if path.startswith("/live/") else None
+                if i is None or extension not in ("mjpg", "jpg"):
+                    self.send_error(404)
+                    return
+                live.add_viewer(i)
+                try:
+                    if extension == "jpg":
+                        self.send_snapshot(i)
+                    else:
+                        self.send_stream(i)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Viewer went away
+                finally:
+                    live.remove_viewer(i)
+
+            def send_index(self):
+                links = "".join(f'<li><a href="/live/{html.escape(quote(name))}.mjpg">{html.escape(name)}</a></li>'
+                                for name in live.camera_manager.camera_names)
+                body = f"<html><body><ul>{links}</ul></body></html>".encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_snapshot(self, i):
+                # The last JPEG may be from an earlier viewer, so wait for a fresh one
+                latest = live.next_jpeg(i, live.jpegs[i][0])
+                if latest is None:
+                    self.send_error(503, "No frame from camera")
+                    return
+                _, data = latest
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_stream(self, i):
+                self.send_response(200)
+                self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                last_seq, data = live.jpegs[i]
+                while live.running:
+                    latest = live.next_jpeg(i, last_seq)
+                    if not live.running:
+                        break
+                    if latest is not None:
+                        last_seq, data = latest
+                    elif data is None:
+                        # Nothing to repeat yet, but a write is the only way to
+                        # notice a viewer that went away
+                        self.wfile.write(b"\r\n")
+                        self.wfile.flush()
+                        continue
+                    # On a timeout the last frame is sent again as a keep-alive
+                    self.wfile.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n".encode())
+                    self.wfile.write(data)
+                    self.wfile.write(b"\r\n")
+                    self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.running = True
+        self.threads = [threading.Thread(target=self.encode_frames, args=(i,), name=f"live-{name}", daemon=True)
+                        for i, name in enumerate(self.camera_manager.camera_names)]
+        for thread in self.threads:
+            thread.start()
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever, name="live", daemon=True)
+        thread.start()
+
+    def stop(self):
+        self.running = False
+        for condition in self.conditions:
+            with condition:
+                condition.notify_all()
+        for listener in self.listeners:
+            self.camera_manager.remove_frame_listener(listener)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self.threads:
+            thread.join()
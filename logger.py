@@ -1,68 +1,152 @@
 import os
+import json
+import queue
+import atexit
 import logging
+import logging.handlers
 from datetime import datetime
 
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+class JsonLinesFormatter(logging.Formatter):
+    # One JSON object per line: time, level, message plus the structured
+    # fields (event, camera, file, stats, ...) passed to Logger.log
+    def format(self, record):
+        event = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'message': record.getMessage()}
+        event.update(getattr(record, 'fields', {}))
+        return json.dumps(event, default=str)
+
+def create_file_handler(log_dir, json_lines=False):
+    # The current day goes to camera_log.log (.jsonl); at midnight it is
+    # renamed to camera_log_<YYYYMMDD>.log, the name daily logs always had
+    extension = ".jsonl" if json_lines else ".log"
+    handler = logging.handlers.TimedRotatingFileHandler(
+        os.path.join(log_dir, "camera_log" + extension), when="midnight", delay=True)
+    handler.suffix = "%Y%m%d"
+    handler.namer = lambda name: os.path.join(log_dir, f"camera_log_{name.rsplit('.', 1)[1]}{extension}")
+    handler.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
+    return handler
+
+def configure_logging(log_dir="logs", json_lines=False, log_queue=None):
+    # Sets up the camera log of this process once; later calls return the
+    # same logger. Log calls only put the record on a queue, a single listener
+    # thread does the formatting and the file I/O. With log_queue (a
+    # multiprocessing queue) records are handed to another process instead,
+    # see listen_for_logs.
+    global _listener
+    logger = logging.getLogger(__name__)
+    if logger.handlers:
+        return logger
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if log_queue is None:
+        os.makedirs(log_dir, exist_ok=True)
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, create_file_handler(log_dir, json_lines))
+        _listener.start()
+        atexit.register(stop_logging)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+def listen_for_logs(log_queue):
+    # Writes records other processes put on log_queue to this process's log
+    listener = logging.handlers.QueueListener(log_queue, configure_logging())
+    listener.start()
+    return listener
+
+def stop_logging():
+    # Flushes what is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
 class Logger:
-    def __init__(self, log_dir="logs"):
+    def __init__(self, log_dir="logs", json_lines=False):
         self.log_dir = log_dir
-        os.makedirs(self.log_dir, exist_ok=True)
-        self.current_log_file = None
-        self.logger = None
-        self.current_date = None
+        self.logger = configure_logging(log_dir, json_lines)
         self.camera_connected = {}  # To track initial connection
-        self.start_new_log()
-
-    def start_new_log(self):
-        current_date = datetime.now().date()
-        if self.current_date != current_date:
-            self.current_date = current_date
-            date_str = current_date.strftime("%Y%m%d")
-            self.current_log_file = os.path.join(self.log_dir, f"camera_log_{date_str}.log")
-            
-            if self.logger:
-                for handler in self.logger.handlers[:]:
-                    self.logger.removeHandler(handler)
-            else:
-                self.logger = logging.getLogger(__name__)
-            
-            self.logger.setLevel(logging.INFO)
-            file_handler = logging.FileHandler(self.current_log_file)
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-            file_handler.setFormatter(formatter)
-            self.logger.addHandler(file_handler)
-
-    def log(self, message, level=logging.INFO):
-        self.start_new_log()
-        self.logger.log(level, message)
+
+    def log(self, message, level=logging.INFO, **fields):
+        self.logger.log(level, message, extra={'fields': fields})
 
     def log_recording_start(self):
-        self.log("Recording started")
+        self.log("Recording started", event="recording_start")
 
     def log_recording_stop(self):
-        self.log("Recording stopped")
+        self.log("Recording stopped", event="recording_stop")
 
     def log_file_start(self, camera_name, file_name):
-        self.log(f"Started recording file: {file_name} for camera {camera_name}")
+        self.log(f"Started recording file: {file_name} for camera {camera_name}",
+                 event="file_start", camera=camera_name, file=file_name)
 
-    def log_file_save(self, camera_name, file_name):
-        self.log(f"Saved recording file: {file_name} for camera {camera_name}")
+    def log_file_save(self, camera_name, file_name, stats=None):
+        message = f"Saved recording file: {file_name} for camera {camera_name}"
+        if stats:
+            message += " (" + ", ".join(f"{key}={value}" for key, value in stats.items()) + ")"
+        self.log(message, event="file_save", camera=camera_name, file=file_name, stats=dict(stats or {}))
 
     def log_camera_disconnect(self, camera_name):
-        self.log(f"Camera {camera_name} disconnected", logging.WARNING)
+        self.log(f"Camera {camera_name} disconnected", logging.WARNING, event="camera_disconnect", camera=camera_name)
         self.camera_connected[camera_name] = False
 
-    def log_camera_connect(self, camera_name):
+    def log_camera_connect(self, camera_name, downtime=None):
         if camera_name not in self.camera_connected or not self.camera_connected[camera_name]:
-            self.log(f"Camera {camera_name} connected")
+            message = f"Camera {camera_name} connected"
         else:
-            self.log(f"Camera {camera_name} reconnected")
+            message = f"Camera {camera_name} reconnected"
+        if downtime is not None:
+            message += f" after {downtime:.1f}s"
+        self.log(message, event="camera_connect", camera=camera_name, downtime=downtime)
         self.camera_connected[camera_name] = True
 
     def log_error(self, error_message, camera_name=None):
         if camera_name:
-            self.log(f"Error occurred for camera {camera_name}: {error_message}", logging.ERROR)
+            self.log(f"Error occurred for camera {camera_name}: {error_message}", logging.ERROR,
+                     event="error", camera=camera_name, error=error_message)
         else:
-            self.log(f"Error occurred: {error_message}", logging.ERROR)
+            self.log(f"Error occurred: {error_message}", logging.ERROR, event="error", error=error_message)
 
     def log_reconnection_attempt(self, camera_name):
-        self.log(f"Attempting to reconnect camera {camera_name}")
\ No newline at end of file
+        self.log(f"Attempting to reconnect camera {camera_name}", event="reconnection_attempt", camera=camera_name)
+
+    def log_worker_exit(self, worker_name, exitcode):
+        self.log(f"Worker {worker_name} exited with code {exitcode}, restarting", logging.WARNING,
+                 event="worker_exit", worker=worker_name, exitcode=exitcode)
+
+    def log_segment_recovered(self, camera_name, file_name, frame_count):
+        self.log(f"Recovered recording file: {file_name} for camera {camera_name} ({frame_count} frames)",
+                 logging.WARNING, event="segment_recovered", camera=camera_name, file=file_name, frames=frame_count)
+
+    def log_segment_discarded(self, camera_name, file_name):
+        self.log(f"Discarded unreadable recording file: {file_name} for camera {camera_name}", logging.WARNING,
+                 event="segment_discarded", camera=camera_name, file=file_name)
+
+    def log_segment_evicted(self, camera_name, file_name, reason):
+        self.log(f"Deleted recording file: {file_name} for camera {camera_name} ({reason})",
+                 event="segment_evicted", camera=camera_name, file=file_name, reason=reason)
+
+    def log_segment_tiered(self, camera_name, file_name, tier, old_size, new_size):
+        self.log(f"Tiered recording file: {file_name} for camera {camera_name} to {tier} "
+                 f"({old_size / 1e6:.1f} MB -> {new_size / 1e6:.1f} MB)",
+                 event="segment_tiered", camera=camera_name, file=file_name, tier=tier, bytes_before=old_size,
+                 bytes_after=new_size)
+
+    def log_stage_stalled(self, stage, camera_name, seconds):
+        self.log(f"{stage.capitalize()} of camera {camera_name} stalled for {seconds:.1f}s, restarting it", logging.WARNING,
+                 event="stage_stalled", stage=stage, camera=camera_name, seconds=round(seconds, 1))
+
+    def log_stage_resumed(self, stage, camera_name, seconds):
+        self.log(f"{stage.capitalize()} of camera {camera_name} resumed after a {seconds:.1f}s stall",
+                 event="stage_resumed", stage=stage, camera=camera_name, seconds=round(seconds, 1))
+
+    def log_stage_replaced(self, stage, camera_name, seconds):
+        self.log(f"{stage.capitalize()} of camera {camera_name} replaced after a {seconds:.1f}s stall",
+                 event="stage_replaced", stage=stage, camera=camera_name, seconds=round(seconds, 1))
+
+    def log_stage_error(self, stage, camera_name, error_message):
+        self.log(f"{stage.capitalize()} of camera {camera_name} failed: {error_message}", logging.ERROR,
+                 event="stage_error", stage=stage, camera=camera_name, error=error_message)
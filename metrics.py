@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class RateMeter:
+    # Event counter plus a per-second rate, recomputed about once a second.
+    # mark() is a couple of additions so it can sit on the per-frame path.
+    def __init__(self, window=1.0):
+        self.window = window
+        self.total = 0
+        self.rate = 0.0
+        self.window_start = None
+        self.window_count = 0
+
+    def mark(self, now, count=1):
+        self.total += count
+        self.window_count += count
+        if self.window_start is None:
+            self.window_start = now
+        elif now - self.window_start >= self.window:
+            self.rate = self.window_count / (now - self.window_start)
+            self.window_start = now
+            self.window_count = 0
+
+    def current_rate(self, now):
+        # A stream that stopped shows up as 0 rather than its last rate
+        if self.window_start is None or now - self.window_start > 2 * self.window:
+            return 0.0
+        return self.rate
+
+class LatencySummary:
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+class CameraMetrics:
+    # Per-camera pipeline telemetry of one CameraManager. The per-frame hooks
+    # only bump counters; everything derived from writers and connection state
+    # is read when the metrics are collected.
+    def __init__(self, camera_names):
+        self.camera_names = camera_names
+        self.captured = [RateMeter() for _ in camera_names]
+        self.previewed = [RateMeter() for _ in camera_names]
+        self.decode = [LatencySummary() for _ in camera_names]
+        self.finalize = [LatencySummary() for _ in camera_names]
+        self.rollover = [LatencySummary() for _ in camera_names]
+        self.last_frame_times = [None] * len(camera_names)
+        self.pool_skipped = [0] * len(camera_names)  # Frames not decoded because the frame pool was empty
+        self.lock = threading.Lock()
+        # Writers still counted live, and the totals of the ones already finalized
+        self.live_writers = [set() for _ in camera_names]
+        self.writer_totals = [{'written': 0, 'dropped': 0, 'overrun': 0, 'bytes': 0} for _ in camera_names]
+
+    def frame_captured(self, i, timestamp):
+        self.captured[i].mark(timestamp)
+        self.last_frame_times[i] = timestamp
+
+    def frame_skipped(self, i):
+        self.pool_skipped[i] += 1
+
+    def frame_previewed(self, i, timestamp):
+        self.previewed[i].mark(timestamp)
+
+    def writer_started(self, i, writer):
+        with self.lock:
+            self.live_writers[i].add(writer)
+
+    def writer_finished(self, i, writer, size, seconds):
+        with self.lock:
+            self.live_writers[i].discard(writer)
+            totals = self.writer_totals[i]
+            totals['written'] += writer.stats.get('written', 0)
+            totals['dropped'] += writer.stats.get('dropped', 0)
+            totals['overrun'] += writer.stats.get('overrun', 0)
+            totals['bytes'] += size
+        self.finalize[i].observe(seconds)
+
+    def writer_abandoned(self, i, writer):
+        # A stuck writer given up on: its counts so far are kept, nothing is finalized
+        with self.lock:
+            self.live_writers[i].discard(writer)
+            totals = self.writer_totals[i]
+            for key in ('written', 'dropped', 'overrun'):
+                totals[key] += writer.stats.get(key, 0)
+
+    def writer_counts(self, i):
+        with self.lock:
+            counts = dict(self.writer_totals[i])
+            depth = 0
+            for writer in self.live_writers[i]:
+                counts['written'] += writer.stats.get('written', 0)
+                counts['dropped'] += writer.stats.get('dropped', 0)
+                counts['overrun'] += writer.stats.get('overrun', 0)
+                depth += writer.queue.qsize()
+                try:
+                    counts['bytes'] += os.path.getsize(writer.partialFilename)
+                except OSError:
+                    pass
+        counts['queue_depth'] = depth
+        return counts
+
+    def collect(self, connections=None):
+        # Returns metric families as (name, type, help, [(labels, value), ...])
+        now = time.time()
+        connection_states = connections.snapshot() if connections is not None else {}
+        families = {}
+        def add(name, kind, help_text, labels, value):
+            families.setdefault(name, (name, kind, help_text, []))[3].append((labels, value))
+
+        for i, camera in enumerate(self.camera_names):
+            labels = {'camera': camera}
+            add("camera_frames_captured_total", "counter", "Frames (packets in copy mode) read from the camera",
+                labels, self.captured[i].total)
+            add("camera_capture_fps", "gauge", "Frames per second read from the camera",
+                labels, self.captured[i].current_rate(now))
+            add("camera_decode_seconds", "summary", "Time spent decoding a frame after it was grabbed",
+                labels, self.decode[i])
+            add("camera_preview_frames_total", "counter", "Frames drawn by the preview", labels, self.previewed[i].total)
+            add("camera_preview_fps", "gauge", "Frames per second drawn by the preview",
+                labels, self.previewed[i].current_rate(now))
+            counts = self.writer_counts(i)
+            add("camera_writer_queue_depth", "gauge", "Items waiting in the writer queues", labels, counts['queue_depth'])
+            add("camera_frames_written_total", "counter", "Frames (packets in copy mode) written to disk",
+                labels, counts['written'])
+            add("camera_frames_dropped_total", "counter", "Frames lost before reaching disk",
+                dict(labels, reason="queue"), counts['dropped'])
+            add("camera_frames_dropped_total", "counter", "Frames lost before reaching disk",
+                dict(labels, reason="overrun"), counts['overrun'])
+            add("camera_frames_dropped_total", "counter", "Frames lost before reaching disk",
+                dict(labels, reason="pool"), self.pool_skipped[i])
+            add("camera_disk_bytes_total", "counter", "Bytes written to recording files, rate() gives bytes per second",
+                labels, counts['bytes'])
+            add("camera_chunk_rollover_seconds", "summary", "Time the capture thread spends switching to the next chunk",
+                labels, self.rollover[i])
+            add("camera_chunk_finalize_seconds", "summary", "Time from closing a chunk to it being on disk and catalogued",
+                labels, self.finalize[i])
+            last_frame_time = self.last_frame_times[i]
+            if last_frame_time is not None:
+                add("camera_seconds_since_last_frame", "gauge", "Seconds since the last frame was read",
+                    labels, now - last_frame_time)
+            state = connection_states.get(camera)
+            if state is not None:
+                add("camera_connected", "gauge", "1 while the camera is connected",
+                    labels, 1 if state['state'] == "connected" else 0)
+                add("camera_reconnects_total", "counter", "Times the camera was lost after being connected",
+                    labels, state['outages'])
+                add("camera_connect_attempts_total", "counter", "Attempts to open the camera", labels, state['attempts'])
+        return [(name, kind, help_text, [(labels, snapshot_value(value)) for labels, value in samples])
+                for name, kind, help_text, samples in families.values()]
+
+def snapshot_value(value):
+    # Summaries become plain (count, sum) tuples so a collection can be pickled
+    if isinstance(value, LatencySummary):
+        return (value.count, value.sum)
+    return value
+
+def format_labels(labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+def format_metrics(families):
+    # Prometheus text exposition format
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if kind == "summary":
+                count, total = value
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            else:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+def merge_families(collections):
+    # Combines the collections of several managers (one per worker) into one
+    merged = {}
+    for families in collections:
+        for name, kind, help_text, samples in families:
+            merged.setdefault(name, (name, kind, help_text, []))[3].extend(samples)
+    return list(merged.values())
+
+class MetricsServer:
+    # Serves collect() in Prometheus text format on /metrics from a daemon thread
+    def __init__(self, collect, host="127.0.0.1", port=9108):
+        self.collect = collect
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        collect = self.collect
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = format_metrics(collect()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
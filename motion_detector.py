@@ -0,0 +1,30 @@
+import cv2
+import numpy as np
+
+class MotionDetector:
+    # Frame differencing against a running-average background on a small
+    # grayscale copy of the frame. Downscaling first keeps the per-frame cost
+    # in the tens of microseconds, whatever the camera resolution.
+    def __init__(self, width=160, threshold=25, min_changed=0.01, alpha=0.05):
+        self.width = width
+        self.threshold = threshold      # Per-pixel intensity change that counts as changed
+        self.min_changed = min_changed  # Fraction of changed pixels that counts as motion
+        self.alpha = alpha              # How fast the background adapts to lighting changes
+        self.background = None
+        self.changed = 0.0
+
+    def update(self, frame):
+        height = max(1, frame.shape[0] * self.width // frame.shape[1])
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(np.float32)
+            return False
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        self.changed = np.count_nonzero(diff > self.threshold) / diff.size
+        cv2.accumulateWeighted(gray, self.background, self.alpha)
+        return self.changed >= self.min_changed
+
+    def reset(self):
+        self.background = None
+        self.changed = 0.0
@@ -0,0 +1,127 @@
+import av
+import cv2
+import logging
+
+class PacketCapture:
+    # Drop-in for cv2.VideoCapture that demuxes the stream with PyAV so the
+    # compressed packets can be recorded as-is. Packets are only decoded when
+    # retrieve() is called, but then every packet since the previous retrieve
+    # (or the last keyframe, if that is later) goes through the decoder, as
+    # the wanted frame depends on them.
+    def __init__(self, url, options=None, timeout=None):
+        self.url = url
+        self.options = options if options is not None else {'rtsp_transport': 'tcp'}
+        self.timeout = timeout  # Seconds, or an (open, read) tuple as taken by av.open
+        self.packet_sink = None
+        self.container = None
+        self.stream = None
+        self.packets = None
+        self.pending = []
+        self.keyframe_decoder = None
+        self.keyframe = False  # Whether the last grabbed packet is a keyframe
+        self.keyframe_decoder = None
+        self.logger = logging.getLogger(__name__)
+        try:
+            self.container = av.open(url, options=self.options, timeout=self.timeout)
+            self.stream = self.container.streams.video[0]
+            self.stream.codec_context.thread_type = 'AUTO'
+            self.packets = self.container.demux(self.stream)
+        except (av.FFmpegError, IndexError) as e:
+            self.logger.error(f"Cannot open {url} for stream copy: {str(e)}")
+            self.release()
+
+    def isOpened(self):
+        return self.container is not None
+
+    def get(self, prop):
+        if self.stream is None:
+            return 0
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.stream.codec_context.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.stream.codec_context.height
+        if prop == cv2.CAP_PROP_FPS:
+            rate = self.stream.average_rate or self.stream.guessed_rate
+            return float(rate) if rate else 0
+        return 0
+
+    def grab(self):
+        if self.packets is None:
+            return False
+        try:
+            for packet in self.packets:
+                if packet.dts is None:
+                    continue
+                if self.packet_sink:
+                    self.packet_sink(packet)
+                # Everything before a keyframe is useless to the decoder, so
+                # an unconsumed stream never accumulates more than one GOP.
+                if packet.is_keyframe:
+                    self.pending = []
+                self.keyframe = packet.is_keyframe
+                self.pending.append(packet)
+                return True
+        except av.FFmpegError as e:
+            self.logger.error(f"Error demuxing {self.url}: {str(e)}")
+        return False
+
+    def retrieve(self, image=None):
+        # (True, None) when packets were there but the decoder has no frame
+        # out yet (frame threading, waiting for the first keyframe): the
+        # stream is alive, there is just nothing to show for this grab
+        had_packets = bool(self.pending)
+        packets, self.pending = self.pending, []
+        frame = None
+        try:
+            for packet in packets:
+                for decoded in self.stream.codec_context.decode(packet):
+                    frame = decoded
+        except av.FFmpegError as e:
+            self.logger.error(f"Error decoding {self.url}: {str(e)}")
+        if frame is None:
+            return had_packets, None
+        return True, to_image(frame, image)
+
+    def retrieve_keyframe(self, image=None):
+        # Decodes only the keyframe just grabbed, for a still such as a
+        # thumbnail. It goes through a decoder of its own, drained right away,
+        # so the frame comes out of this one packet without waiting for frame
+        # threads and the packets pending for retrieve() stay where they are.
+        # (True, None) when the last packet was not a keyframe or did not decode.
+        if not self.keyframe or not self.pending:
+            return bool(self.pending), None
+        frame = None
+        try:
+            if self.keyframe_decoder is None:
+                self.keyframe_decoder = av.CodecContext.create(self.stream.codec_context.name, 'r')
+                self.keyframe_decoder.extradata = self.stream.codec_context.extradata
+            for packet in (self.pending[-1], None):
+                for decoded in self.keyframe_decoder.decode(packet):
+                    frame = decoded
+            self.keyframe_decoder.flush_buffers()
+        except av.FFmpegError as e:
+            self.logger.error(f"Error decoding {self.url}: {str(e)}")
+        if frame is None:
+            return True, None
+        return True, to_image(frame, image)
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+        self.container = None
+        self.packets = None
+        self.pending = []
+        self.keyframe_decoder = None
+
+def to_image(frame, image=None):
+    # BGR array of a decoded frame, into image when it has the right shape
+    array = frame.to_ndarray(format='bgr24')
+    if image is not None and image.shape == array.shape:
+        image[...] = array
+        return image
+    return array
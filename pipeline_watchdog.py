@@ -0,0 +1,102 @@
+import threading
+import time
+
+# Added to every allowance, a stage is only a stall once it is clearly late
+STALL_GRACE = 2.0
+
+class Watchdog:
+    # Checks the liveness of the pipeline stages from its own thread. A stage
+    # is watched through probe(), which returns None while the stage is idle
+    # or waiting on purpose, or (last_progress, allowance): the monotonic time
+    # it last made progress and how many seconds it may take until the next.
+    # A stage past its allowance is logged and handed to on_stall() once;
+    # when it makes progress again the length of the stall is logged, as a
+    # replacement if on_stall() returned True for having replaced the stage.
+    # on_stall() runs on a thread of its own, as it may block on the same
+    # locks or disk as the stalled stage, and can return False when it could
+    # not act yet to be called again at the next check.
+    def __init__(self, logger, check_interval=1.0):
+        self.logger = logger
+        self.check_interval = check_interval
+        self.stages = {}  # (stage, camera name) -> (probe, on_stall)
+        self.stalled = {}  # (stage, camera name) -> last progress before the stall
+        self.handling = set()  # Stages whose on_stall() is running
+        self.retry = set()  # Stalled stages whose on_stall() returned False
+        self.replaced = set()  # Stalled stages whose on_stall() replaced them
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def watch(self, stage, camera_name, probe, on_stall):
+        with self.lock:
+            self.stages[(stage, camera_name)] = (probe, on_stall)
+
+    def start(self):
+        if self.thread:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while not self.stop_event.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.log_error(f"Watchdog check failed: {str(e)}")
+
+    def check(self):
+        now = time.monotonic()
+        with self.lock:
+            stages = list(self.stages.items())
+        for key, (probe, on_stall) in stages:
+            progress = probe()
+            stall_start = self.stalled.get(key)
+            if key in self.handling:
+                continue  # Whether it resumed or was replaced is only known once on_stall() returns
+            if stall_start is not None and (progress is None or progress[0] > stall_start):
+                del self.stalled[key]
+                self.retry.discard(key)
+                if key in self.replaced:
+                    self.replaced.discard(key)
+                    self.logger.log_stage_replaced(key[0], key[1], now - stall_start)
+                else:
+                    self.logger.log_stage_resumed(key[0], key[1], (progress[0] if progress else now) - stall_start)
+                stall_start = None
+            if stall_start is not None:
+                if key in self.retry and key not in self.handling:
+                    self.retry.discard(key)
+                    self.handle_stall(key, on_stall)
+                continue
+            if progress is None or now - progress[0] <= progress[1] + STALL_GRACE:
+                continue
+            self.stalled[key] = progress[0]
+            self.logger.log_stage_stalled(key[0], key[1], now - progress[0])
+            self.handle_stall(key, on_stall)
+
+    def handle_stall(self, key, on_stall):
+        if key in self.handling:
+            return
+        self.handling.add(key)
+        thread = threading.Thread(target=self.run_handler, args=(key, on_stall), name=f"watchdog-{key[0]}-{key[1]}",
+                                  daemon=True)
+        thread.start()
+
+    def run_handler(self, key, on_stall):
+        try:
+            result = on_stall()
+            if result is False:
+                self.retry.add(key)
+            elif result:
+                self.replaced.add(key)
+        except Exception as e:
+            self.logger.log_error(f"Cannot restart stalled {key[0]}: {str(e)}", key[1])
+        finally:
+            self.handling.discard(key)
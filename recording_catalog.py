@@ -0,0 +1,195 @@
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    camera TEXT NOT NULL,
+    date TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    start_time REAL NOT NULL,
+    end_time REAL,
+    frame_count INTEGER,
+    bytes INTEGER,
+    codec TEXT,
+    status TEXT NOT NULL,
+    tier TEXT,
+    thumbnail_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS segments_camera_time ON segments (camera, start_time);
+CREATE INDEX IF NOT EXISTS segments_time ON segments (start_time);
+CREATE INDEX IF NOT EXISTS segments_camera_date_index ON segments (camera, date, chunk_index);
+"""
+
+# Muxer options that make a segment written with PyAV readable up to its last
+# second or so if the process dies: short Matroska clusters, fragmented MP4,
+# and every packet handed to the OS as soon as it is muxed
+STREAMING_CONTAINER_OPTIONS = {
+    '.mkv': {'cluster_time_limit': '1000', 'flush_packets': '1'},
+    '.mp4': {'movflags': 'frag_keyframe+empty_moov+default_base_moof', 'flush_packets': '1'},
+    '.ts': {'flush_packets': '1'},
+}
+
+def streaming_options(path):
+    return STREAMING_CONTAINER_OPTIONS.get(os.path.splitext(path)[1], {})
+
+def partial_path(path):
+    # Where a segment is written until it is finalized:
+    # front_20240828_140000_3.mkv -> front_20240828_140000_3.partial.mkv
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.partial{extension}"
+
+class RecordingCatalog:
+    # SQLite index of the segments under a recordings directory. Paths are
+    # stored relative to that directory. A segment is inserted as "recording"
+    # when its chunk starts and becomes "complete" once the file is finalized.
+    # Safe to share between threads, and between processes through SQLite's
+    # own locking (each worker owns different cameras).
+    def __init__(self, root_dir, filename="catalog.sqlite3"):
+        self.root_dir = root_dir
+        self.path = os.path.join(root_dir, filename)
+        self.lock = threading.Lock()
+        self.next_indices = {}
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.migrate()
+
+    def migrate(self):
+        # Catalogs created before segments could be tiered lack the tier
+        # column, those from before thumbnails were counted thumbnail_bytes
+        columns = {row['name'] for row in self.connection.execute("PRAGMA table_info(segments)")}
+        for column, column_type in (('tier', "TEXT"), ('thumbnail_bytes', "INTEGER")):
+            if column not in columns:
+                try:
+                    self.connection.execute(f"ALTER TABLE segments ADD COLUMN {column} {column_type}")
+                except sqlite3.OperationalError:
+                    pass  # Another process added it first
+
+    def relative_path(self, path):
+        return os.path.relpath(path, self.root_dir)
+
+    def resolve(self, path):
+        return os.path.join(self.root_dir, path)
+
+    def next_index(self, camera, date_str):
+        # Hands out chunk indices per camera and day. Only the first call for a
+        # (camera, day) touches the database; a day the catalog knows nothing
+        # about gets a one-off scan of its directory, for recordings made
+        # before the catalog existed.
+        with self.lock:
+            key = (camera, date_str)
+            if key not in self.next_indices:
+                row = self.connection.execute(
+                    "SELECT MAX(chunk_index) FROM segments WHERE camera = ? AND date = ?", (camera, date_str)).fetchone()
+                last_index = row[0] if row[0] is not None else self.scan_last_index(camera, date_str)
+                self.next_indices[key] = last_index + 1
+            index = self.next_indices[key]
+            self.next_indices[key] = index + 1
+            return index
+
+    def scan_last_index(self, camera, date_str):
+        max_index = -1
+        date_dir = os.path.join(self.root_dir, date_str)
+        if not os.path.isdir(date_dir):
+            return max_index
+        for filename in os.listdir(date_dir):
+            # <camera>_<YYYYMMDD>_<HHMMSS>_<index>.<ext>, the camera name may contain '_'
+            parts = os.path.splitext(filename)[0].rsplit('_', 3)
+            if len(parts) == 4 and parts[0] == camera and parts[1] == date_str:
+                try:
+                    max_index = max(max_index, int(parts[3]))
+                except ValueError:
+                    pass
+        return max_index
+
+    def open_segment(self, camera, path, chunk_index, start_time, codec):
+        date_str = os.path.basename(os.path.dirname(path))
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO segments (camera, date, chunk_index, path, start_time, codec, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'recording')",
+                (camera, date_str, chunk_index, self.relative_path(path), start_time, codec))
+
+    def unfinished_segments(self, cameras):
+        # Segments still marked "recording", i.e. left behind by a crash
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT * FROM segments WHERE status = 'recording' AND camera IN ({','.join('?' * len(cameras))}) "
+                "ORDER BY start_time", list(cameras)).fetchall()
+
+    def close_segment(self, path, end_time, frame_count, size):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE segments SET end_time = ?, frame_count = ?, bytes = ?, status = 'complete' WHERE path = ?",
+                (end_time, frame_count, size, self.relative_path(path)))
+
+    def set_thumbnail_bytes(self, path, size):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE segments SET thumbnail_bytes = ? WHERE path = ?", (size, self.relative_path(path)))
+
+    def find_segments(self, camera, start_time, end_time):
+        # Segments of a camera overlapping [start_time, end_time), oldest first
+        with self.lock:
+            return self.connection.execute(
+                "SELECT * FROM segments WHERE camera = ? AND start_time < ? AND (end_time IS NULL OR end_time > ?) "
+                "ORDER BY start_time", (camera, end_time, start_time)).fetchall()
+
+    def usage_by_camera(self):
+        # Bytes of finished segments and their thumbnails per camera, read once
+        # when retention starts
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT camera, SUM(COALESCE(bytes, 0) + COALESCE(thumbnail_bytes, 0)) FROM segments "
+                "WHERE status = 'complete' GROUP BY camera").fetchall()
+        return {camera: total or 0 for camera, total in rows}
+
+    def oldest_segments(self, camera=None, ended_before=None, limit=50):
+        # Finished segments, oldest first, optionally for one camera and/or
+        # ended before a given time. Segments still recording are never listed.
+        query = "SELECT * FROM segments WHERE status = 'complete'"
+        params = []
+        if camera is not None:
+            query += " AND camera = ?"
+            params.append(camera)
+        if ended_before is not None:
+            query += " AND end_time < ?"
+            params.append(ended_before)
+        query += " ORDER BY start_time LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            return self.connection.execute(query, params).fetchall()
+
+    def untiered_segments(self, ended_before, limit=50):
+        # Finished segments that were never tiered, oldest day first
+        with self.lock:
+            return self.connection.execute(
+                "SELECT * FROM segments WHERE status = 'complete' AND tier IS NULL AND end_time < ? "
+                "ORDER BY date, start_time LIMIT ?", (ended_before, limit)).fetchall()
+
+    def replace_segment(self, path, new_path, tier, frame_count, size, codec):
+        # Points a segment at its tiered file. Returns False if the segment
+        # is no longer in the catalog, e.g. retention deleted it meanwhile.
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE segments SET path = ?, tier = ?, frame_count = ?, bytes = ?, codec = ? WHERE path = ?",
+                (self.relative_path(new_path), tier, frame_count, size, codec, self.relative_path(path)))
+            return cursor.rowcount > 0
+
+    def mark_tier(self, path, tier):
+        # Records that a segment was looked at but kept as it is
+        with self.lock:
+            self.connection.execute("UPDATE segments SET tier = ? WHERE path = ?", (tier, self.relative_path(path)))
+
+    def remove_segment(self, path):
+        with self.lock:
+            self.connection.execute("DELETE FROM segments WHERE path = ?", (self.relative_path(path),))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,170 @@
+import os
+import shutil
+import threading
+import time
+from logger import Logger
+from recording_catalog import RecordingCatalog
+from segment_thumbnails import thumbnail_paths
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parse_size(text):
+    # "500G", "1.5T", "750M" or a plain number of bytes
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def parse_camera_quota(text):
+    # "front=200G" -> ("front", 214748364800)
+    camera, _, size = text.partition('=')
+    return camera, parse_size(size)
+
+class RetentionManager:
+    # Deletes the oldest finished segments once a camera goes over its quota,
+    # all cameras together go over global_quota, the volume has less than
+    # min_free bytes left, or a segment is older than max_age seconds. Usage
+    # (segments and their thumbnail sidecars) is read from the catalog once at
+    # start and then kept up to date from chunk_saved and thumbnails_saved
+    # events and the evictions themselves, the recordings tree is never
+    # walked. Recordings made before the catalog existed are not counted.
+    def __init__(self, root_dir, camera_quotas=None, global_quota=None, max_age=None, min_free=None,
+                 check_interval=60, batch_size=50):
+        self.root_dir = root_dir
+        self.camera_quotas = camera_quotas or {}
+        self.global_quota = global_quota
+        self.max_age = max_age
+        self.min_free = min_free
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+        self.logger = Logger()
+        self.usage = {}
+        self.usage_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.catalog = None
+        self.stats = {'evicted': 0, 'evicted_bytes': 0}
+
+    def start(self):
+        if self.thread:
+            return
+        self.catalog = RecordingCatalog(self.root_dir)
+        with self.usage_lock:
+            self.usage = self.catalog.usage_by_camera()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="retention", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+        self.catalog.close()
+
+    def chunk_event(self, camera, event, path):
+        # Chunk listener for a CameraManager or, through the supervisor, its workers
+        if event == "chunk_saved":
+            self.segment_saved(camera, path)
+        elif event == "thumbnails_saved":
+            self.thumbnails_saved(camera, path)
+
+    def segment_saved(self, camera, path):
+        # Called from the recording side for every finished chunk; only a stat
+        # and a counter update, the deleting happens on the retention thread
+        self.add_usage(camera, [path])
+
+    def thumbnails_saved(self, camera, path):
+        # The sprite and index of a segment are written after it is saved
+        self.add_usage(camera, thumbnail_paths(path))
+
+    def add_usage(self, camera, paths):
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        with self.usage_lock:
+            self.usage[camera] = self.usage.get(camera, 0) + size
+        if self.over_quota():
+            self.wakeup.set()
+
+    def segment_replaced(self, camera, old_size, new_size):
+        # A segment was swapped for a smaller tiered version
+        with self.usage_lock:
+            self.usage[camera] = max(0, self.usage.get(camera, 0) - old_size + new_size)
+
+    def total_usage(self):
+        with self.usage_lock:
+            return sum(self.usage.values())
+
+    def camera_usage(self, camera):
+        with self.usage_lock:
+            return self.usage.get(camera, 0)
+
+    def over_quota(self):
+        if self.global_quota is not None and self.total_usage() > self.global_quota:
+            return True
+        return any(self.camera_usage(camera) > quota for camera, quota in self.camera_quotas.items())
+
+    def low_free_space(self):
+        return self.min_free is not None and shutil.disk_usage(self.root_dir).free < self.min_free
+
+    def run(self):
+        # Linux schedules threads individually, so this only lowers the
+        # priority of the retention thread and leaves the writers alone
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while self.running:
+            try:
+                self.enforce()
+            except Exception as e:
+                self.logger.log_error(f"Retention check failed: {str(e)}")
+            self.wakeup.wait(self.check_interval)
+            self.wakeup.clear()
+
+    def enforce(self):
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            self.evict_while(lambda: True, "max age", ended_before=cutoff)
+        for camera, quota in self.camera_quotas.items():
+            self.evict_while(lambda: self.camera_usage(camera) > quota, "camera quota", camera=camera)
+        if self.global_quota is not None:
+            self.evict_while(lambda: self.total_usage() > self.global_quota, "global quota")
+        if self.min_free is not None:
+            self.evict_while(self.low_free_space, "free space")
+
+    def evict_while(self, condition, reason, camera=None, ended_before=None):
+        while self.running and condition():
+            segments = self.catalog.oldest_segments(camera, ended_before, self.batch_size)
+            if not segments:
+                return
+            for segment in segments:
+                if not self.running or not condition():
+                    return
+                self.evict(segment, reason)
+
+    def evict(self, segment, reason):
+        path = self.catalog.resolve(segment['path'])
+        for file_path in (path, *thumbnail_paths(path)):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        self.catalog.remove_segment(path)
+        size = (segment['bytes'] or 0) + (segment['thumbnail_bytes'] or 0)
+        with self.usage_lock:
+            self.usage[segment['camera']] = max(0, self.usage.get(segment['camera'], 0) - size)
+        self.stats['evicted'] += 1
+        self.stats['evicted_bytes'] += size
+        self.logger.log_segment_evicted(segment['camera'], os.path.basename(path), reason)
+        try:
+            os.rmdir(os.path.dirname(path))  # Only succeeds once the day directory is empty
+        except OSError:
+            pass
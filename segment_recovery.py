@@ -0,0 +1,120 @@
+import os
+import av
+from recording_catalog import partial_path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+def lock_cameras(root_dir, cameras):
+    # Takes a lock file per camera under root_dir/.locks, held for as long as
+    # the returned files stay open, so recovery never touches the live
+    # partial files of a camera another process (the GUI, a second headless
+    # instance, a worker) is recording. Returns (lock files, cameras locked
+    # by another process).
+    lock_dir = os.path.join(root_dir, ".locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    locks, busy = [], []
+    for camera in cameras:
+        lock_file = open(os.path.join(lock_dir, f"{camera}.lock"), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                busy.append(camera)
+                continue
+        locks.append(lock_file)
+    return locks, busy
+
+def recover_segments(catalog, cameras, logger, stager=None):
+    # Closes out what a crash left behind for these cameras. Only catalog rows
+    # still marked "recording" (and their directories) are looked at, never
+    # the whole recordings tree. A partial file is remuxed, without decoding,
+    # into a finalized segment up to its last readable packet; segments with
+    # nothing usable are dropped from disk and catalog. With a stager the
+    # partial file may also be in its staging area.
+    directories = set()
+    for segment in catalog.unfinished_segments(cameras):
+        path = catalog.resolve(segment['path'])
+        directories.add(os.path.dirname(path))
+        partial = partial_path(path)
+        if stager is not None and not os.path.exists(partial) and os.path.exists(stager.staging_path(path)):
+            partial = stager.staging_path(path)
+        if os.path.exists(partial):
+            result = salvage(partial, path)
+        elif os.path.exists(path):
+            # Renamed but the catalog was never updated
+            result = probe(path)
+        else:
+            result = None
+        file_name = os.path.basename(path)
+        if result is None:
+            for leftover in (partial, path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            catalog.remove_segment(path)
+            logger.log_segment_discarded(segment['camera'], file_name)
+            continue
+        frame_count, duration = result
+        catalog.close_segment(path, segment['start_time'] + duration, frame_count, os.path.getsize(path))
+        logger.log_segment_recovered(segment['camera'], file_name, frame_count)
+
+    # Chunks that were pre-opened but never started have no catalog row and
+    # no frames, they can simply go, as can half-written thumbnail files
+    if stager is not None:
+        directories |= {os.path.join(stager.staging_dir, os.path.relpath(directory, stager.output_dir))
+                        for directory in directories}
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for file_name in os.listdir(directory):
+            if (".partial." in file_name or file_name.endswith(".tmp")) and file_name.rsplit('_', 3)[0] in cameras:
+                os.remove(os.path.join(directory, file_name))
+
+def salvage(partial, path):
+    # Copies every readable packet of partial into path and removes partial.
+    # Returns (frame_count, duration) or None if nothing could be read.
+    stem, extension = os.path.splitext(path)
+    salvage_path = f"{stem}.salvage{extension}"
+    frame_count, first_pts, last_pts, time_base = 0, None, None, None
+    try:
+        with av.open(partial) as source:
+            stream = source.streams.video[0]
+            output = av.open(salvage_path, 'w')
+            out_stream = output.add_stream_from_template(stream)
+            try:
+                for packet in source.demux(stream):
+                    if packet.size == 0:
+                        continue
+                    pts = packet.pts if packet.pts is not None else packet.dts
+                    if pts is not None:
+                        first_pts = pts if first_pts is None else min(first_pts, pts)
+                        last_pts = pts if last_pts is None else max(last_pts, pts)
+                    time_base = packet.time_base
+                    packet.stream = out_stream
+                    output.mux(packet)
+                    frame_count += 1
+            except av.FFmpegError:
+                pass  # The file ends mid-packet where the process died
+            output.close()
+    except (av.FFmpegError, IndexError):
+        frame_count = 0
+    if not frame_count:
+        if os.path.exists(salvage_path):
+            os.remove(salvage_path)
+        return None
+    os.replace(salvage_path, path)
+    os.remove(partial)
+    duration = float((last_pts - first_pts) * time_base) if first_pts is not None else 0.0
+    return frame_count, duration
+
+def probe(path):
+    try:
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            duration = container.duration / av.time_base if container.duration else 0.0
+            return stream.frames, duration
+    except (av.FFmpegError, IndexError):
+        return None
@@ -0,0 +1,176 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import LatencySummary, snapshot_value
+from recording_catalog import partial_path
+
+FSYNC_POLICIES = ("none", "file", "durable")
+
+def default_staging_dir():
+    # tmpfs where there is one, so staged segments live in RAM
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "rtsp-staging")
+
+class SegmentStager:
+    # Lets writers build their segments in a RAM-backed staging directory
+    # instead of on slow storage. A finished segment is copied to the
+    # recordings directory by one I/O thread in large sequential blocks, so
+    # the disk sees one stream of big writes instead of many writers'
+    # small interleaved ones. fsync policy after the copy:
+    #   none     leave it to the OS
+    #   file     fsync the segment before it is renamed into place
+    #   durable  also fsync the directory after the rename
+    # limit bounds the staged bytes: each staged segment reserves the size of
+    # its camera's last segment (a fair share of limit until there is one)
+    # and a segment is only staged while the reservations, or the actual
+    # sizes where they grew past them, fit. Otherwise the writer goes to disk
+    # directly. A segment whose copy failed stays staged and is retried with
+    # the next flush; one whose writer was abandoned is moved to disk as a
+    # partial file for recovery. Staged partials also survive a crash of the
+    # process (not of the machine) and are salvaged by recovery.
+    def __init__(self, output_dir, camera_names, staging_dir=None, limit=512 * 1024 ** 2, fsync="file",
+                 block_size=8 * 1024 ** 2):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}. Expected one of {FSYNC_POLICIES}")
+        self.output_dir = output_dir
+        self.staging_dir = staging_dir or default_staging_dir()
+        self.limit = limit
+        self.fsync = fsync
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        # Staged path -> (camera, reserved bytes), for segments being written or waiting to be flushed
+        self.staged = {}
+        self.failed = {}  # Staged path -> final path, copies to retry
+        self.last_sizes = {}
+        self.camera_names = camera_names
+        self.flushes = {camera: LatencySummary() for camera in camera_names}
+        self.flushed_bytes = {camera: 0 for camera in camera_names}
+        self.bypassed = {camera: 0 for camera in camera_names}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="staging-io")
+
+    def staging_path(self, path):
+        # recordings/20240828/front_..._3.mkv -> <staging dir>/20240828/front_..._3.partial.mkv
+        return os.path.join(self.staging_dir, os.path.relpath(partial_path(path), self.output_dir))
+
+    def staged_bytes(self, camera=None):
+        with self.lock:
+            paths = [path for path, (owner, _) in self.staged.items() if camera is None or owner == camera]
+        return sum(file_size(path) for path in paths)
+
+    def stage(self, camera, path):
+        # Returns where the writer should build the segment, or None if
+        # staging is full and it should write to disk directly
+        expected = self.last_sizes.get(camera) or self.limit // max(1, len(self.camera_names))
+        staged = self.staging_path(path)
+        with self.lock:
+            committed = sum(max(reserved, file_size(staged_path)) for staged_path, (_, reserved) in self.staged.items())
+            if committed + expected > self.limit:
+                self.bypassed[camera] += 1
+                return None
+            self.staged[staged] = (camera, expected)
+        os.makedirs(os.path.dirname(staged), exist_ok=True)
+        return staged
+
+    def commit(self, staged, path):
+        # Called from the writer's stop(); blocks until the segment is on disk under path
+        self.executor.submit(self.flush, staged, path).result()
+
+    def evacuate(self, staged, path):
+        # Called when the writer is abandoned: the staged file goes to disk
+        # under its partial name, where recovery salvages it at the next start
+        self.executor.submit(self.move_to_disk, staged, partial_path(path))
+
+    def flush(self, staged, path):
+        self.retry_failed()
+        camera, _ = self.staged.get(staged, (None, 0))
+        flush_start = time.perf_counter()
+        if not os.path.exists(staged):
+            self.forget(staged)
+            return
+        size = os.path.getsize(staged)
+        try:
+            self.copy(staged, path)
+        except OSError:
+            self.failed[staged] = path
+            raise
+        self.forget(staged)
+        if camera is not None:
+            self.last_sizes[camera] = size
+            self.flushed_bytes[camera] += size
+            self.flushes[camera].observe(time.perf_counter() - flush_start)
+
+    def retry_failed(self):
+        # The segment already counts as given up on, a late copy leaves it
+        # renamed but still marked as recording, which recovery closes out
+        for staged, path in list(self.failed.items()):
+            try:
+                if os.path.exists(staged):
+                    self.copy(staged, path)
+            except OSError:
+                continue
+            del self.failed[staged]
+            self.forget(staged)
+
+    def move_to_disk(self, staged, target):
+        try:
+            if os.path.exists(staged):
+                with open(staged, 'rb') as source, open(target, 'wb') as output:
+                    shutil.copyfileobj(source, output, self.block_size)
+                os.remove(staged)
+        except OSError:
+            return  # Left staged and counted, recovery finds it there as well
+        self.forget(staged)
+
+    def copy(self, staged, path):
+        # Copies staged to path through its partial name in large blocks,
+        # syncing as the fsync policy says, and removes staged
+        working = partial_path(path)
+        try:
+            with open(staged, 'rb') as source, open(working, 'wb', buffering=0) as target:
+                shutil.copyfileobj(source, target, self.block_size)
+                if self.fsync != "none":
+                    os.fsync(target.fileno())
+        except OSError:
+            if os.path.exists(working):
+                os.remove(working)
+            raise
+        os.replace(working, path)
+        if self.fsync == "durable":
+            directory = os.open(os.path.dirname(path), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        os.remove(staged)
+
+    def forget(self, staged):
+        with self.lock:
+            self.staged.pop(staged, None)
+
+    def collect(self):
+        # Metric families in the format of CameraMetrics.collect
+        families = [
+            ("camera_staging_bytes", "gauge", "Bytes of segments held in the staging area", []),
+            ("camera_staging_flush_seconds", "summary", "Time to copy a staged segment to the recordings directory", []),
+            ("camera_staging_flushed_bytes_total", "counter", "Bytes copied from the staging area to disk", []),
+            ("camera_staging_bypassed_total", "counter", "Segments written to disk directly because staging was full", []),
+        ]
+        for camera in self.camera_names:
+            labels = {'camera': camera}
+            families[0][3].append((labels, self.staged_bytes(camera)))
+            families[1][3].append((labels, snapshot_value(self.flushes[camera])))
+            families[2][3].append((labels, self.flushed_bytes[camera]))
+            families[3][3].append((labels, self.bypassed[camera]))
+        return families
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
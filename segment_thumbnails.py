@@ -0,0 +1,130 @@
+import argparse
+import json
+import math
+import os
+import threading
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from recording_catalog import RecordingCatalog
+
+def thumbnail_paths(path):
+    # front_20240828_140000_3.mkv -> front_20240828_140000_3.sprite.jpg, front_20240828_140000_3.thumbs.json
+    stem = os.path.splitext(path)[0]
+    return f"{stem}.sprite.jpg", f"{stem}.thumbs.json"
+
+class SegmentThumbnails:
+    # Collects small copies of frames the capture threads already decoded,
+    # about one per second, for each segment being recorded. When a segment
+    # is finalized its thumbnails become a sprite sheet plus a JSON index
+    # (offset in seconds -> tile position) written next to it. The JPEG
+    # encoding and file writes run on a small low-priority pool so they
+    # never hold up a capture thread.
+    def __init__(self, width=160, columns=10, quality=70, max_workers=1):
+        self.width = width
+        self.columns = columns
+        self.quality = quality
+        self.samples = {}  # Segment path -> (start time, [(timestamp, thumbnail), ...])
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnails",
+                                           initializer=self.lower_priority)
+
+    @staticmethod
+    def lower_priority():
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+    def start(self, path, start_time):
+        with self.lock:
+            self.samples[path] = (start_time, [])
+
+    def add(self, path, frame, timestamp):
+        # Called from the capture thread; a resize of one frame a second
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        thumbnail = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_LINEAR)
+        with self.lock:
+            if path in self.samples:
+                self.samples[path][1].append((timestamp, thumbnail))
+
+    def finish(self, path):
+        with self.lock:
+            start_time, samples = self.samples.pop(path, (None, []))
+        if samples:
+            return self.executor.submit(self.write, path, start_time, samples)
+
+    def write(self, path, start_time, samples):
+        # A frame size change mid-segment starts a new ring and a new chunk,
+        # so all thumbnails of a segment have the same size
+        tile_height, tile_width = samples[0][1].shape[:2]
+        rows = math.ceil(len(samples) / self.columns)
+        sprite = np.zeros((rows * tile_height, min(len(samples), self.columns) * tile_width, 3), np.uint8)
+        thumbnails = []
+        for n, (timestamp, thumbnail) in enumerate(samples):
+            x, y = (n % self.columns) * tile_width, (n // self.columns) * tile_height
+            sprite[y:y + tile_height, x:x + tile_width] = thumbnail
+            thumbnails.append({'time': round(timestamp - start_time, 3), 'x': x, 'y': y})
+        ok, data = cv2.imencode(".jpg", sprite, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return
+        sprite_path, index_path = thumbnail_paths(path)
+        index = {'segment': os.path.basename(path), 'sprite': os.path.basename(sprite_path), 'start_time': start_time,
+                 'tile_width': tile_width, 'tile_height': tile_height, 'thumbnails': thumbnails}
+        # Written under a temporary name first, a reader never sees half a file
+        size = 0
+        for target, content in ((sprite_path, data.tobytes()), (index_path, json.dumps(index).encode())):
+            with open(target + ".tmp", 'wb') as f:
+                f.write(content)
+            os.replace(target + ".tmp", target)
+            size += len(content)
+        return size
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def thumbnail_at(path, seconds):
+    # The thumbnail of a segment closest to seconds after its start, or None
+    # when the segment has no thumbnails
+    sprite_path, index_path = thumbnail_paths(path)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not index['thumbnails']:
+        return None
+    entry = min(index['thumbnails'], key=lambda thumbnail: abs(thumbnail['time'] - seconds))
+    sprite = cv2.imread(sprite_path)
+    if sprite is None:
+        return None
+    x, y = entry['x'], entry['y']
+    return sprite[y:y + index['tile_height'], x:x + index['tile_width']]
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the recorded thumbnail of a camera at a point in time")
+    parser.add_argument('camera', help="Camera name as used in the file names, e.g. front")
+    parser.add_argument('time', type=datetime.fromisoformat, help="Point in time, e.g. 2024-08-28T14:00:00")
+    parser.add_argument('-o', '--output', help="Output image, defaults to <camera>_<time>.jpg")
+    parser.add_argument('--recordings', default=os.path.join(os.getcwd(), "recordings"))
+    args = parser.parse_args()
+
+    output_path = args.output or f"{args.camera}_{args.time.strftime('%Y%m%d_%H%M%S')}.jpg"
+    timestamp = args.time.timestamp()
+    catalog = RecordingCatalog(args.recordings)
+    try:
+        segments = catalog.find_segments(args.camera, timestamp, timestamp + 1)
+        thumbnail = None
+        if segments:
+            segment = segments[-1]
+            thumbnail = thumbnail_at(catalog.resolve(segment['path']), timestamp - segment['start_time'])
+    finally:
+        catalog.close()
+    if thumbnail is None:
+        raise SystemExit(f"No thumbnail for camera {args.camera} at {args.time}")
+    cv2.imwrite(output_path, thumbnail)
+    print(f"Wrote {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import av
+import os
+import threading
+import time
+import logging
+from writer_queue import WriterQueue, join_writer
+from recording_catalog import partial_path, streaming_options
+
+class StreamCopyWriter:
+    # Remuxes compressed packets from a PacketCapture into a segment file
+    # without decoding. The container is picked from the filename extension
+    # (.mkv, .mp4, .ts). The file is written under its partial_path name and
+    # only renamed to filename once it is complete, or, with a stager, built
+    # at stagedFilename in the staging area and copied to disk by stop().
+    def __init__(self, filename, template_stream, maxBufferSize=250, overflowPolicy="keyframe", blockTimeout=1.0,
+                 stager=None, stagedFilename=None):
+        self.template_stream = template_stream
+        self.thread = None
+        self.maxBufferSize = maxBufferSize
+        self.filename = filename
+        self.stager = stager
+        self.partialFilename = stagedFilename if stager is not None else partial_path(filename)
+        self.stats = {'written': 0, 'skipped': 0}
+        self.queue = WriterQueue(maxBufferSize, overflowPolicy, blockTimeout, stats=self.stats)
+        self.error = None  # The exception the writer thread died of
+        self.busySince = None  # Monotonic time the packet being written was taken (or the thread died), None while waiting
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        if self.thread:
+            return
+        def loop():
+            try:
+                output = av.open(self.partialFilename, 'w', container_options=streaming_options(self.filename))
+                out_stream = output.add_stream_from_template(self.template_stream)
+                start_dts = None
+                while self.thread or self.queue.qsize():
+                    self.busySince = None
+                    packet = self.queue.get()
+                    if packet is None:
+                        break
+                    self.busySince = time.monotonic()
+                    if start_dts is None:
+                        # A segment has to begin on a keyframe to be decodable
+                        if not packet.is_keyframe:
+                            self.stats['skipped'] += 1
+                            continue
+                        start_dts = packet.dts
+                    out = av.Packet(bytes(packet))
+                    out.dts = packet.dts - start_dts
+                    out.pts = packet.pts - start_dts if packet.pts is not None else None
+                    out.time_base = packet.time_base
+                    out.is_keyframe = packet.is_keyframe
+                    out.stream = out_stream
+                    output.mux(out)
+                    self.stats['written'] += 1
+                self.busySince = time.monotonic()  # Closing the file can hang on a stuck disk too
+                output.close()
+            except Exception as e:
+                # The thread is gone, the camera manager's watchdog sees the
+                # error and replaces the writer
+                self.busySince = time.monotonic()
+                self.error = e
+                self.logger.error(f"Error in StreamCopyWriter loop: {str(e)}")
+
+        # Daemon so a writer abandoned by the watchdog cannot keep the process alive
+        self.thread = threading.Thread(target=loop, name=f"writer-{os.path.basename(self.filename)}", daemon=True)
+        self.thread.start()
+
+    def stop(self, stallTimeout=None):
+        # See BufferedVideoWriter.stop
+        if not self.thread:
+            return True
+        self.queue.close()
+        t = self.thread
+        self.thread = None
+        if not join_writer(t, self, stallTimeout) or self.error is not None:
+            self.abandon()
+            return False
+        if self.stager is not None:
+            self.stager.commit(self.partialFilename, self.filename)
+        elif os.path.exists(self.partialFilename):
+            os.replace(self.partialFilename, self.filename)
+        return True
+
+    def abandon(self):
+        # See BufferedVideoWriter.abandon
+        self.thread = None
+        self.queue.drain()
+        self.queue.close()
+        if self.stager is not None:
+            self.stager.evacuate(self.partialFilename, self.filename)
+
+    def write(self, packet):
+        if self.thread:
+            return self.queue.put(packet, keyframe=packet.is_keyframe)
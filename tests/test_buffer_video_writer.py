@@ -0,0 +1,62 @@
+import time
+from buffer_video_writer import BufferedVideoWriter
+from frame_pool import FramePool
+
+SHAPE = (48, 64, 3)
+
+def pooled_frames(pool, count):
+    frames = []
+    for value in range(count):
+        frame = pool.acquire()
+        frame[...] = value
+        frames.append(frame)
+    return frames
+
+def test_stop_releases_every_written_frame(tmp_path):
+    pool = FramePool(SHAPE, 8)
+    path = str(tmp_path / "front_20240101_000000_1.mkv")
+    writer = BufferedVideoWriter(path, None, 10, (SHAPE[1], SHAPE[0]), timestamps="pts", framePool=pool)
+    writer.start()
+    start = time.time()
+    for n, frame in enumerate(pooled_frames(pool, 5)):
+        writer.write(frame, start + n / 10, n + 1)
+        pool.release(frame)  # The capture thread's own reference
+    writer.stop()
+    assert pool.in_use() == 0
+    assert writer.stats['written'] == 5
+
+def test_dropped_frames_are_released(tmp_path):
+    pool = FramePool(SHAPE, 8)
+    writer = BufferedVideoWriter(str(tmp_path / "front.mkv"), None, 10, (SHAPE[1], SHAPE[0]), maxBufferSize=2,
+                                 timestamps="pts", overflowPolicy="drop_oldest", framePool=pool)
+    writer.thread = object()  # Accept writes without a thread consuming them
+    for n, frame in enumerate(pooled_frames(pool, 4)):
+        writer.write(frame, float(n), n + 1)
+        pool.release(frame)
+    assert pool.in_use() == 2
+    writer.abandon()
+    assert pool.in_use() == 0
+
+def test_refused_frame_is_released(tmp_path):
+    pool = FramePool(SHAPE, 4)
+    writer = BufferedVideoWriter(str(tmp_path / "front.mkv"), None, 10, (SHAPE[1], SHAPE[0]), maxBufferSize=1,
+                                 timestamps="pts", overflowPolicy="drop_newest", framePool=pool)
+    writer.thread = object()
+    first, second = pooled_frames(pool, 2)
+    assert writer.write(first, 0.0, 1)
+    assert not writer.write(second, 0.1, 2)
+    pool.release(first)
+    pool.release(second)
+    assert pool.in_use() == 1
+    writer.abandon()
+    assert pool.in_use() == 0
+
+def test_writer_that_died_keeps_its_error_and_fails_stop(tmp_path):
+    writer = BufferedVideoWriter(str(tmp_path / "front.mkv"), None, 10, (SHAPE[1], SHAPE[0]), timestamps="pts")
+    writer.start()
+    writer.write("not a frame", time.time(), 1)
+    writer.thread.join(timeout=5)
+    assert writer.error is not None
+    assert writer.busySince is not None  # Seen as stalled by the watchdog
+    assert writer.stop() is False
+    assert not (tmp_path / "front.mkv").exists()  # Left to recovery
@@ -0,0 +1,35 @@
+import time
+import cv2
+import numpy as np
+from camera_manager import CameraManager
+
+def write_source(path, static_frames, moving_frames):
+    # A still scene, then a square moving across it
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (160, 120))
+    for n in range(static_frames + moving_frames):
+        frame = np.full((120, 160, 3), 60, np.uint8)
+        if n >= static_frames:
+            x = (n - static_frames) * 4 % 120
+            frame[30:90, x:x + 40] = 255
+        writer.write(frame)
+    writer.release()
+
+def test_motion_recording_starts_with_a_pool_smaller_than_the_pre_roll(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Recordings and logs go under the working directory
+    source = str(tmp_path / "source.avi")
+    write_source(source, 100, 100)
+    camera_manager = CameraManager([source], record_trigger="motion", frame_pool_size=20, pre_roll=3.0,
+                                   motion_fps=1000, thumbnail_fps=0)
+    events = []
+    camera_manager.add_chunk_listener(lambda i, event, path: events.append(event))
+    camera_manager.start_stream_threads()
+    camera_manager.start_recording()
+    try:
+        deadline = time.time() + 10
+        while "chunk_start" not in events and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        camera_manager.stop_recording()
+        camera_manager.stop_stream_threads(timeout=2)
+        camera_manager.release()
+    assert "chunk_start" in events
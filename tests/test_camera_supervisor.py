@@ -0,0 +1,8 @@
+from camera_supervisor import CameraSupervisor
+
+def test_staging_limit_is_shared_out_between_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The Logger writes to logs/ under the working directory
+    supervisor = CameraSupervisor([f"rtsp://camera{i}/" for i in range(5)], num_workers=2, staging_limit=1000)
+    limits = [supervisor.worker_options(w)['staging_limit'] for w in range(2)]
+    assert limits == [600, 400]
+    assert supervisor.manager_options['staging_limit'] == 1000
@@ -0,0 +1,42 @@
+import numpy as np
+from frame_pool import FramePool
+
+def test_frames_are_allocated_only_when_needed():
+    pool = FramePool((4, 4, 3), 3)
+    assert pool.buffers == []
+    frame = pool.acquire()
+    pool.release(frame)
+    assert pool.acquire() is frame
+    assert len(pool.buffers) == 1
+
+def test_acquire_returns_none_once_every_frame_is_in_use():
+    pool = FramePool((4, 4, 3), 2)
+    first, second = pool.acquire(), pool.acquire()
+    assert first is not None and second is not None
+    assert pool.acquire() is None
+    assert pool.in_use() == 2
+
+def test_frame_returns_to_pool_with_its_last_reference():
+    pool = FramePool((4, 4, 3), 1)
+    frame = pool.acquire()
+    pool.retain(frame)
+    pool.release(frame)
+    assert pool.acquire() is None  # Still retained
+    pool.release(frame)
+    assert pool.in_use() == 0
+    assert pool.acquire() is frame
+
+def test_extra_release_does_not_free_a_frame_twice():
+    pool = FramePool((4, 4, 3), 2)
+    frame = pool.acquire()
+    pool.release(frame)
+    pool.release(frame)
+    assert pool.free.count(frame) == 1
+
+def test_foreign_frames_are_ignored():
+    pool = FramePool((4, 4, 3), 1)
+    foreign = np.zeros((4, 4, 3), dtype=np.uint8)
+    pool.retain(foreign)
+    pool.release(foreign)
+    assert pool.in_use() == 0
+    assert len(pool.buffers) == 0
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pytest
+from frame_ring import FrameRing
+
+SHAPE = (4, 6, 3)
+
+def ring_name():
+    return f"rtsp_test_{os.getpid()}"
+
+def test_slot_is_invalid_once_recycled():
+    ring = FrameRing.create(ring_name(), SHAPE, slots=2)
+    try:
+        seq, _ = ring.write(np.zeros(SHAPE, dtype=np.uint8), 1.0)
+        assert ring.is_valid(seq)
+        ring.write(np.ones(SHAPE, dtype=np.uint8), 2.0)
+        ring.write(np.ones(SHAPE, dtype=np.uint8), 3.0)
+        assert not ring.is_valid(seq)
+    finally:
+        ring.close()
+
+def test_ring_of_a_live_owner_is_not_replaced():
+    ring = FrameRing.create(ring_name(), SHAPE, slots=2)
+    try:
+        with pytest.raises(FileExistsError):
+            FrameRing.create(ring_name(), SHAPE, slots=2)
+        assert ring.is_valid(ring.write(np.zeros(SHAPE, dtype=np.uint8), 1.0)[0])
+    finally:
+        ring.close()
+
+def test_ring_of_a_dead_owner_is_replaced():
+    ring = FrameRing.create(ring_name(), SHAPE, slots=2)
+    ring.header[5] = 2 ** 22 + 12345  # Above the usual pid_max, no such process
+    stale = ring.shm
+    ring.shm = None
+    stale.close()
+    replacement = FrameRing.create(ring_name(), SHAPE, slots=3)
+    try:
+        assert replacement.slots == 3
+    finally:
+        replacement.close()
@@ -0,0 +1,24 @@
+import urllib.request
+from live_server import LiveServer
+
+class Cameras:
+    camera_names = ['<b>back door</b>']
+    ring_slots = 0
+
+    def add_frame_listener(self, listener, max_fps=None, cameras=None):
+        pass
+
+    def remove_frame_listener(self, listener):
+        pass
+
+def test_index_escapes_camera_names():
+    live = LiveServer(Cameras(), port=0)
+    live.start()
+    try:
+        port = live.server.server_address[1]
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/").read().decode()
+    finally:
+        live.stop()
+    assert '<b>' not in body
+    assert 'href="/live/%3Cb%3Eback%20door%3C/b%3E.mjpg"' in body
+    assert '&lt;b&gt;back door&lt;/b&gt;' in body
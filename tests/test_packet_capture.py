@@ -0,0 +1,56 @@
+import av
+import numpy as np
+from packet_capture import PacketCapture
+
+def write_h264(path, frames=30):
+    output = av.open(path, 'w')
+    stream = output.add_stream('libx264', rate=25)
+    stream.width, stream.height = 64, 48
+    stream.pix_fmt = 'yuv420p'
+    for n in range(frames):
+        image = np.full((48, 64, 3), n * 8, dtype=np.uint8)
+        for packet in stream.encode(av.VideoFrame.from_ndarray(image, format='bgr24')):
+            output.mux(packet)
+    for packet in stream.encode():
+        output.mux(packet)
+    output.close()
+
+def test_grab_without_decoded_frame_is_not_a_read_failure(tmp_path):
+    path = str(tmp_path / "source.mp4")
+    write_h264(path)
+    capture = PacketCapture(path)
+    try:
+        results = []
+        while capture.grab():
+            results.append(capture.retrieve())
+        assert results
+        assert all(ret for ret, _ in results)
+        frames = [frame for _, frame in results if frame is not None]
+        assert frames and frames[0].shape == (48, 64, 3)
+    finally:
+        capture.release()
+
+def test_retrieve_without_grab_fails(tmp_path):
+    path = str(tmp_path / "source.mp4")
+    write_h264(path)
+    capture = PacketCapture(path)
+    try:
+        assert capture.retrieve() == (False, None)
+    finally:
+        capture.release()
+
+def test_keyframes_decode_on_their_own(tmp_path):
+    path = str(tmp_path / "source.mp4")
+    write_h264(path, frames=30)
+    capture = PacketCapture(path)
+    try:
+        stills = []
+        while capture.grab():
+            ret, frame = capture.retrieve_keyframe()
+            assert ret
+            assert (frame is not None) == capture.keyframe
+            if frame is not None:
+                stills.append(frame)
+        assert stills and stills[0].shape == (48, 64, 3)
+    finally:
+        capture.release()
@@ -0,0 +1,79 @@
+import threading
+import time
+from pipeline_watchdog import Watchdog, STALL_GRACE
+from writer_queue import join_writer
+
+class RecordingLogger:
+    def __init__(self):
+        self.events = []
+
+    def log_stage_stalled(self, stage, camera, seconds):
+        self.events.append(("stalled", stage, camera))
+
+    def log_stage_resumed(self, stage, camera, seconds):
+        self.events.append(("resumed", stage, camera))
+
+    def log_stage_replaced(self, stage, camera, seconds):
+        self.events.append(("replaced", stage, camera))
+
+    def log_error(self, message, camera=None):
+        self.events.append(("error", message, camera))
+
+STALLED_AT = time.monotonic() - STALL_GRACE - 10
+
+def stalled_probe():
+    return STALLED_AT, 1.0
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_blocking_handler_does_not_hold_up_other_stages():
+    watchdog = Watchdog(RecordingLogger())
+    release = threading.Event()
+    restarted = []
+    watchdog.watch("writer", "front", stalled_probe, release.wait)
+    watchdog.watch("writer", "rear", stalled_probe, lambda: restarted.append("rear"))
+    watchdog.check()
+    assert wait_for(lambda: restarted == ["rear"])
+    release.set()
+
+def test_handler_returning_false_is_retried_without_logging_again():
+    logger = RecordingLogger()
+    watchdog = Watchdog(logger)
+    calls = []
+    watchdog.watch("writer", "front", stalled_probe, lambda: calls.append(1) or len(calls) > 1)
+    watchdog.check()
+    assert wait_for(lambda: calls and not watchdog.handling)
+    watchdog.check()
+    assert wait_for(lambda: len(calls) == 2)
+    assert logger.events.count(("stalled", "writer", "front")) == 1
+
+def test_replaced_stage_is_logged_as_replaced():
+    logger = RecordingLogger()
+    watchdog = Watchdog(logger)
+    progress = [(STALLED_AT, 1.0)]
+    def replace():
+        progress[0] = None  # The new stage is idle
+        return True
+    watchdog.watch("writer", "front", lambda: progress[0], replace)
+    watchdog.check()
+    assert wait_for(lambda: not watchdog.handling)
+    watchdog.check()
+    assert logger.events == [("stalled", "writer", "front"), ("replaced", "writer", "front")]
+
+class BusyWriter:
+    busySince = None
+
+def test_join_writer_gives_up_on_a_stuck_item():
+    writer = BusyWriter()
+    release = threading.Event()
+    thread = threading.Thread(target=release.wait, daemon=True)
+    thread.start()
+    writer.busySince = time.monotonic() - 10
+    assert not join_writer(thread, writer, stallTimeout=5)
+    release.set()
+    thread.join()
+    assert join_writer(thread, writer, stallTimeout=5)
@@ -0,0 +1,11 @@
+from recording_catalog import RecordingCatalog
+
+def test_index_scan_handles_camera_names_with_underscores(tmp_path):
+    date_dir = tmp_path / "20240828"
+    date_dir.mkdir()
+    (date_dir / "back_door_20240828_140000_4.mkv").write_bytes(b"")
+    (date_dir / "door_20240828_140000_9.mkv").write_bytes(b"")
+    catalog = RecordingCatalog(str(tmp_path))
+    assert catalog.scan_last_index("back_door", "20240828") == 4
+    assert catalog.scan_last_index("door", "20240828") == 9
+    assert catalog.scan_last_index("back", "20240828") == -1
@@ -0,0 +1,34 @@
+from recording_catalog import RecordingCatalog
+from retention_manager import RetentionManager
+from segment_thumbnails import thumbnail_paths
+
+def save_segment(catalog, tmp_path, name, size, thumbnail_size):
+    path = str(tmp_path / "20240828" / name)
+    with open(path, 'wb') as f:
+        f.write(b"x" * size)
+    for sidecar in thumbnail_paths(path):
+        with open(sidecar, 'wb') as f:
+            f.write(b"x" * (thumbnail_size // 2))
+    catalog.open_segment("front", path, 0, 0.0, "mjpeg")
+    catalog.close_segment(path, 60.0, 600, size)
+    return path
+
+def test_usage_counts_thumbnail_sidecars(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The Logger writes to logs/ under the working directory
+    (tmp_path / "20240828").mkdir()
+    catalog = RecordingCatalog(str(tmp_path))
+    first = save_segment(catalog, tmp_path, "front_20240828_140000_0.mkv", 1000, 200)
+    catalog.set_thumbnail_bytes(first, 200)
+    retention = RetentionManager(str(tmp_path))
+    retention.start()
+    try:
+        assert retention.camera_usage("front") == 1200
+        second = save_segment(catalog, tmp_path, "front_20240828_140100_1.mkv", 500, 100)
+        retention.chunk_event("front", "chunk_saved", second)
+        retention.chunk_event("front", "thumbnails_saved", second)
+        assert retention.camera_usage("front") == 1800
+        retention.evict(catalog.oldest_segments("front", limit=1)[0], "test")
+        assert retention.camera_usage("front") == 600
+    finally:
+        retention.stop()
+        catalog.close()
@@ -0,0 +1,17 @@
+from segment_recovery import lock_cameras
+
+def test_camera_locked_by_another_recorder_is_reported_busy(tmp_path):
+    locks, busy = lock_cameras(str(tmp_path), ["front", "rear"])
+    assert busy == []
+    try:
+        second, busy = lock_cameras(str(tmp_path), ["front", "side"])
+        assert busy == ["front"]
+        for lock_file in second:
+            lock_file.close()
+    finally:
+        for lock_file in locks:
+            lock_file.close()
+    again, busy = lock_cameras(str(tmp_path), ["front"])
+    assert busy == []
+    for lock_file in again:
+        lock_file.close()
@@ -0,0 +1,62 @@
+import os
+import pytest
+from segment_staging import SegmentStager
+
+def make_stager(tmp_path, cameras=("front", "rear"), limit=1000):
+    output_dir = tmp_path / "recordings"
+    (output_dir / "20240101").mkdir(parents=True)
+    return SegmentStager(str(output_dir), list(cameras), staging_dir=str(tmp_path / "staging"), limit=limit)
+
+def segment_path(stager, name):
+    return os.path.join(stager.output_dir, "20240101", name)
+
+def test_segments_opened_together_share_the_limit(tmp_path):
+    stager = make_stager(tmp_path, cameras=("a", "b", "c", "d"), limit=1000)
+    staged = [stager.stage(camera, segment_path(stager, f"{camera}_20240101_000000_1.mkv")) for camera in "abcd"]
+    assert all(staged)
+    assert stager.stage("a", segment_path(stager, "a_20240101_000100_2.mkv")) is None
+    assert stager.bypassed["a"] == 1
+    stager.close()
+
+def test_flush_moves_segment_to_disk_and_frees_its_reservation(tmp_path):
+    stager = make_stager(tmp_path)
+    path = segment_path(stager, "front_20240101_000000_1.mkv")
+    staged = stager.stage("front", path)
+    with open(staged, 'wb') as f:
+        f.write(b"x" * 300)
+    stager.commit(staged, path)
+    assert os.path.getsize(path) == 300
+    assert not os.path.exists(staged)
+    assert stager.staged == {}
+    assert stager.last_sizes["front"] == 300
+    stager.close()
+
+def test_failed_copy_is_retried_with_the_next_flush(tmp_path):
+    stager = make_stager(tmp_path)
+    path = segment_path(stager, "front_20240101_000000_1.mkv")
+    staged = stager.stage("front", path)
+    with open(staged, 'wb') as f:
+        f.write(b"x" * 10)
+    os.rename(os.path.dirname(path), os.path.dirname(path) + ".gone")
+    with pytest.raises(OSError):
+        stager.commit(staged, path)
+    assert staged in stager.staged
+    os.rename(os.path.dirname(path) + ".gone", os.path.dirname(path))
+    other = segment_path(stager, "rear_20240101_000000_1.mkv")
+    other_staged = stager.stage("rear", other)
+    stager.commit(other_staged, other)
+    assert os.path.exists(path)
+    assert stager.staged == {}
+    stager.close()
+
+def test_abandoned_segment_goes_to_disk_as_partial(tmp_path):
+    stager = make_stager(tmp_path)
+    path = segment_path(stager, "front_20240101_000000_1.mkv")
+    staged = stager.stage("front", path)
+    with open(staged, 'wb') as f:
+        f.write(b"x" * 10)
+    stager.evacuate(staged, path)
+    stager.close()
+    assert os.path.exists(segment_path(stager, "front_20240101_000000_1.partial.mkv"))
+    assert not os.path.exists(staged)
+    assert stager.staged == {}
@@ -0,0 +1,35 @@
+from writer_queue import WriterQueue
+
+def test_evicted_items_are_passed_to_on_drop():
+    dropped = []
+    queue = WriterQueue(2, "drop_oldest", onDrop=dropped.append)
+    for item in ("a", "b", "c"):
+        assert queue.put(item)
+    assert dropped == ["a"]
+    assert queue.stats['dropped'] == 1
+    assert [queue.get(), queue.get()] == ["b", "c"]
+
+def test_refused_item_is_reported_by_put_not_on_drop():
+    dropped = []
+    queue = WriterQueue(1, "drop_newest", onDrop=dropped.append)
+    assert queue.put("a")
+    assert not queue.put("b")
+    assert dropped == []
+    assert queue.stats['dropped'] == 1
+
+def test_keyframe_policy_evicts_whole_gop():
+    dropped = []
+    queue = WriterQueue(3, "keyframe", onDrop=dropped.append)
+    for item, keyframe in (("k1", True), ("p1", False), ("p2", False)):
+        queue.put(item, keyframe=keyframe)
+    assert queue.put("k2", keyframe=True)
+    assert dropped == ["k1", "p1", "p2"]
+    assert queue.get() == "k2"
+
+def test_drain_returns_items_without_the_end_marker():
+    queue = WriterQueue(4)
+    queue.put("a")
+    queue.put("b")
+    queue.close()
+    assert queue.drain() == ["a", "b"]
+    assert queue.qsize() == 0
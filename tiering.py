@@ -0,0 +1,297 @@
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+import av
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from fractions import Fraction
+from logger import Logger
+from recording_catalog import RecordingCatalog, partial_path
+from retention_manager import parse_size
+from segment_thumbnails import thumbnail_paths
+
+TIER_TIME_BASE = Fraction(1, 1000)
+
+# fps None keeps every frame, scale shrinks both sides, crf is the x264
+# quality. Frames keep their recorded timestamps, so a time-lapse is a
+# sparse recording of the same length rather than a sped-up one.
+TIER_PROFILES = {
+    "h264": {'fps': None, 'scale': 1.0, 'crf': 26},
+    "reduced": {'fps': 5, 'scale': 0.5, 'crf': 28},
+    "timelapse": {'fps': 0.5, 'scale': 0.5, 'crf': 30},
+}
+
+def tiered_path(path, tier):
+    # front_20240828_140000_3.avi -> front_20240828_140000_3.reduced.mkv
+    return f"{os.path.splitext(path)[0]}.{tier}.mkv"
+
+class IoThrottle:
+    # Sleeps in consume() so the bytes read and written average at most rate per second
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.bytes = 0
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        self.bytes += size
+        ahead = self.bytes / self.rate - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+def lower_priority():
+    # Worker processes only get the CPU the recorder leaves over
+    try:
+        os.nice(19)
+    except (AttributeError, OSError):
+        pass
+
+def transcode_segment(source_path, output_path, profile, io_limit=None):
+    # Re-encodes a segment as single-threaded H.264 in Matroska. Returns the
+    # frames written and the duration of the source.
+    throttle = IoThrottle(io_limit)
+    interval = 1.0 / profile['fps'] if profile['fps'] else 0.0
+    frames, first_time, last_time, kept_time, last_pts = 0, None, None, None, -1
+    with av.open(source_path) as source:
+        stream = source.streams.video[0]
+        stream.codec_context.thread_count = 1
+        output = av.open(output_path, 'w')
+        try:
+            out_stream = output.add_stream('libx264')
+            # Even sizes, yuv420p cannot be encoded otherwise
+            out_stream.width = max(2, int(stream.codec_context.width * profile['scale']) // 2 * 2)
+            out_stream.height = max(2, int(stream.codec_context.height * profile['scale']) // 2 * 2)
+            out_stream.pix_fmt = 'yuv420p'
+            out_stream.codec_context.time_base = TIER_TIME_BASE
+            out_stream.codec_context.options = {'preset': 'veryfast', 'crf': str(profile['crf']), 'threads': '1'}
+            offset = stream.start_time
+            for packet in source.demux(stream):
+                throttle.consume(packet.size)
+                for frame in packet.decode():
+                    if frame.pts is None:
+                        continue
+                    if offset is None:
+                        offset = frame.pts
+                    frame_time = float((frame.pts - offset) * frame.time_base)
+                    first_time = frame_time if first_time is None else min(first_time, frame_time)
+                    last_time = frame_time if last_time is None else max(last_time, frame_time)
+                    if kept_time is not None and frame_time - kept_time < interval:
+                        continue
+                    kept_time = frame_time
+                    # The encoder scales and converts the frame to the stream format
+                    last_pts = max(int(round(frame_time * 1000)), last_pts + 1)
+                    frame.pts = last_pts
+                    frame.time_base = TIER_TIME_BASE
+                    for out in out_stream.encode(frame):
+                        throttle.consume(out.size)
+                        output.mux(out)
+                    frames += 1
+            for out in out_stream.encode():
+                throttle.consume(out.size)
+                output.mux(out)
+        finally:
+            output.close()
+    return frames, (last_time - first_time) if first_time is not None else 0.0
+
+def verify_segment(path, frames, duration, interval):
+    # The tiered file has to demux completely, with every frame written and
+    # covering the source up to the frames dropped on purpose, and its first
+    # frame has to decode
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        packets, first_pts, last_pts = 0, None, None
+        for packet in container.demux(stream):
+            if packet.size == 0 or packet.pts is None:
+                continue
+            packets += 1
+            first_pts = packet.pts if first_pts is None else min(first_pts, packet.pts)
+            last_pts = packet.pts if last_pts is None else max(last_pts, packet.pts)
+        if packets != frames or first_pts is None:
+            return False
+        if float((last_pts - first_pts) * stream.time_base) < duration - max(1.0, 2 * interval):
+            return False
+    with av.open(path) as container:
+        return next(container.decode(video=0), None) is not None
+
+def tier_segment(source_path, final_path, profile, io_limit=None):
+    # Runs in a worker process. The reduced version is written under its
+    # partial name and only renamed to final_path once verified, so an
+    # existing final_path is always a complete, checked file.
+    working_path = partial_path(final_path)
+    try:
+        frames, duration = transcode_segment(source_path, working_path, profile, io_limit)
+        interval = 1.0 / profile['fps'] if profile['fps'] else 0.0
+        if not frames or not verify_segment(working_path, frames, duration, interval):
+            raise ValueError(f"Tiered version of {os.path.basename(source_path)} failed verification")
+    except BaseException:
+        if os.path.exists(working_path):
+            os.remove(working_path)
+        raise
+    os.replace(working_path, final_path)
+    return frames
+
+class TieringJob:
+    # Replaces finished segments older than min_age seconds by a reduced
+    # version (see TIER_PROFILES), oldest day first. Segments are re-encoded
+    # by a pool of niced worker processes, each limited to one encoder thread
+    # and a share of io_limit bytes per second, and no new segment is handed
+    # out while the load average per core is above max_load. Each segment is
+    # finished on its own and marked in the catalog, so a stopped or crashed
+    # job carries on where it was. Segments that fail are marked "failed"
+    # and kept as they are.
+    def __init__(self, root_dir, tier="reduced", min_age=3 * 86400, workers=1, io_limit=None, max_load=1.0,
+                 check_interval=3600, batch_size=50, on_replaced=None):
+        if tier not in TIER_PROFILES:
+            raise ValueError(f"Unknown tier: {tier}. Expected one of {tuple(TIER_PROFILES)}")
+        self.root_dir = root_dir
+        self.tier = tier
+        self.profile = TIER_PROFILES[tier]
+        self.min_age = min_age
+        self.workers = workers
+        self.io_limit = io_limit
+        self.max_load = max_load
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+        self.on_replaced = on_replaced  # on_replaced(camera, old_size, new_size)
+        self.logger = Logger()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.catalog = None
+        self.executor = None
+        self.stats = {'tiered': 0, 'kept': 0, 'failed': 0, 'bytes_saved': 0}
+
+    def open(self):
+        self.catalog = RecordingCatalog(self.root_dir)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=lower_priority)
+        self.running = True
+
+    def close(self):
+        # Segments in progress are finished, the rest waits for the next run
+        self.running = False
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.catalog.close()
+
+    def start(self):
+        if self.thread:
+            return
+        self.open()
+        self.thread = threading.Thread(target=self.run, name="tiering", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+        self.close()
+
+    def run(self):
+        while self.running:
+            try:
+                self.tier_segments()
+            except Exception as e:
+                self.logger.log_error(f"Tiering failed: {str(e)}")
+            self.wakeup.wait(self.check_interval)
+            self.wakeup.clear()
+
+    def overloaded(self):
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1) > self.max_load
+        except (AttributeError, OSError):
+            return False
+
+    def tier_segments(self):
+        # Keeps at most one segment per worker in flight
+        pending = {}
+        while self.running:
+            segments = self.catalog.untiered_segments(time.time() - self.min_age, self.batch_size)
+            segments = [segment for segment in segments if segment['path'] not in pending]
+            if not segments and not pending:
+                return
+            for segment in segments:
+                if not self.running or len(pending) >= self.workers:
+                    break
+                if self.overloaded():
+                    self.wakeup.wait(10)
+                    break
+                path = self.catalog.resolve(segment['path'])
+                final_path = tiered_path(path, self.tier)
+                if os.path.exists(final_path):
+                    # Verified by an earlier run that stopped before switching over
+                    self.finish(segment, final_path)
+                    continue
+                future = self.executor.submit(tier_segment, path, final_path, self.profile,
+                                              self.io_limit / self.workers if self.io_limit else None)
+                pending[segment['path']] = (future, segment, final_path)
+            if pending:
+                done, _ = wait([future for future, _, _ in pending.values()], return_when=FIRST_COMPLETED)
+                for key, (future, segment, final_path) in list(pending.items()):
+                    if future not in done:
+                        continue
+                    del pending[key]
+                    error = future.exception()
+                    if error is not None:
+                        self.stats['failed'] += 1
+                        self.catalog.mark_tier(self.catalog.resolve(segment['path']), "failed")
+                        self.logger.log_error(f"Cannot tier {segment['path']}: {str(error)}", segment['camera'])
+                    else:
+                        self.finish(segment, final_path)
+
+    def finish(self, segment, final_path):
+        # Switches the catalog and the thumbnails over to the tiered file and
+        # deletes the original, unless the tiered file came out bigger
+        path = self.catalog.resolve(segment['path'])
+        old_size = segment['bytes'] or (os.path.getsize(path) if os.path.exists(path) else 0)
+        new_size = os.path.getsize(final_path)
+        if new_size >= old_size:
+            os.remove(final_path)
+            self.catalog.mark_tier(path, "original")
+            self.stats['kept'] += 1
+            return
+        with av.open(final_path) as container:
+            frame_count = sum(1 for packet in container.demux(video=0) if packet.size)
+        if not self.catalog.replace_segment(path, final_path, self.tier, frame_count, new_size, "h264"):
+            os.remove(final_path)  # Deleted by retention meanwhile
+            return
+        for old, new in zip(thumbnail_paths(path), thumbnail_paths(final_path)):
+            if os.path.exists(old):
+                os.replace(old, new)
+        if os.path.exists(path):
+            os.remove(path)
+        self.stats['tiered'] += 1
+        self.stats['bytes_saved'] += old_size - new_size
+        self.logger.log_segment_tiered(segment['camera'], os.path.basename(path), self.tier, old_size, new_size)
+        if self.on_replaced:
+            self.on_replaced(segment['camera'], old_size, new_size)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replace old recordings by smaller versions")
+    parser.add_argument('--tier', choices=TIER_PROFILES, default="reduced")
+    parser.add_argument('--older-than', type=float, default=3, help="Only segments older than this many days")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes")
+    parser.add_argument('--io-limit', type=parse_size, default=None, help="Bytes per second read plus written, e.g. 20M")
+    parser.add_argument('--max-load', type=float, default=1.0,
+                        help="Pause while the load average per core is above this")
+    parser.add_argument('--recordings', default=os.path.join(os.getcwd(), "recordings"))
+    args = parser.parse_args()
+
+    job = TieringJob(args.recordings, tier=args.tier, min_age=args.older_than * 86400, workers=args.workers,
+                     io_limit=args.io_limit, max_load=args.max_load)
+    job.open()
+    try:
+        job.tier_segments()
+    except KeyboardInterrupt:
+        print("Stopped, the next run continues where this one was")
+    finally:
+        job.close()
+    print(f"Tiered {job.stats['tiered']} segments, saved {job.stats['bytes_saved'] / 1e6:.1f} MB "
+          f"({job.stats['kept']} kept, {job.stats['failed']} failed)")
+
+if __name__ == "__main__":
+    main()
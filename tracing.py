@@ -0,0 +1,67 @@
+import collections
+import json
+import math
+import os
+import threading
+import time
+
+class Tracer:
+    # Opt-in span timings for the pipeline stages. Per-frame stages are only
+    # recorded for one frame in sample_every, picked by frame sequence number,
+    # so every thread (capture, writer, preview) traces the same frames;
+    # per-chunk stages are always recorded. Spans go into a bounded deque, the
+    # oldest falling out once max_spans is reached. Without a tracer the
+    # instrumented code only pays a None check.
+    def __init__(self, sample_every=10, max_spans=200000):
+        self.sample_every = max(1, sample_every)
+        self.spans = collections.deque(maxlen=max_spans)
+        self.origin = time.perf_counter()
+
+    def sampled(self, seq):
+        return seq is not None and seq % self.sample_every == 0
+
+    def add(self, stage, camera, start, end=None, seq=None):
+        # start and end are time.perf_counter() values, end defaults to now
+        end = time.perf_counter() if end is None else end
+        self.spans.append((stage, camera, threading.current_thread().name, start, end, seq))
+
+    def export_chrome_trace(self, path):
+        # Chrome trace event format, opens in chrome://tracing and ui.perfetto.dev.
+        # One track per thread, every span carries its camera and frame.
+        pid = os.getpid()
+        thread_ids = {}
+        events = []
+        for stage, camera, thread, start, end, seq in list(self.spans):
+            if thread not in thread_ids:
+                thread_ids[thread] = len(thread_ids) + 1
+                events.append({'name': "thread_name", 'ph': "M", 'pid': pid, 'tid': thread_ids[thread],
+                               'args': {'name': thread}})
+            args = {'camera': camera}
+            if seq is not None:
+                args['seq'] = seq
+            events.append({'name': stage, 'cat': camera, 'ph': "X", 'pid': pid, 'tid': thread_ids[thread],
+                           'ts': round((start - self.origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+                           'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, f)
+
+    def summary(self):
+        # [(stage, camera, count, p50_ms, p99_ms, max_ms)] sorted by stage and camera
+        durations = collections.defaultdict(list)
+        for stage, camera, _, start, end, _ in list(self.spans):
+            durations[(stage, camera)].append((end - start) * 1000)
+        rows = []
+        for (stage, camera), values in sorted(durations.items()):
+            values.sort()
+            rows.append((stage, camera, len(values), percentile(values, 0.5), percentile(values, 0.99), values[-1]))
+        return rows
+
+    def format_summary(self):
+        lines = [f"{'stage':<12} {'camera':<10} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for stage, camera, count, p50, p99, longest in self.summary():
+            lines.append(f"{stage:<12} {camera:<10} {count:>7} {p50:>9.2f} {p99:>9.2f} {longest:>9.2f}")
+        return "\n".join(lines)
+
+def percentile(values, fraction):
+    # Nearest rank on sorted values
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
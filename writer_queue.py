@@ -0,0 +1,113 @@
+import collections
+import threading
+import time
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block", "keyframe")
+
+class WriterQueue:
+    # Bounded hand-off between a capture thread and a writer thread. What
+    # happens when it is full depends on the policy:
+    #   drop_oldest  evict the oldest queued item
+    #   drop_newest  discard the incoming item
+    #   block        wait up to blockTimeout for room, then discard the incoming item
+    #   keyframe     never leave a broken GOP behind: once something has to go,
+    #                drop up to the next keyframe (evicting the oldest GOP if a
+    #                keyframe arrives to a full queue)
+    # Counters go into the stats dict passed in, so they end up next to the
+    # writer's own numbers. onDrop(item) is called for queued items that get
+    # evicted; an incoming item that is refused is reported by put() instead.
+    def __init__(self, maxsize, policy="drop_newest", blockTimeout=1.0, stats=None, onDrop=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}. Expected one of {OVERFLOW_POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.blockTimeout = blockTimeout
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+        self.dropping_gop = False
+        self.stats = stats if stats is not None else {}
+        self.onDrop = onDrop
+        for key in ('enqueued', 'dropped', 'max_depth'):
+            self.stats.setdefault(key, 0)
+
+    def qsize(self):
+        return len(self.items)
+
+    def put(self, item, keyframe=True):
+        with self.condition:
+            if not self.make_room(keyframe):
+                self.stats['dropped'] += 1
+                return False
+            self.items.append((item, keyframe))
+            self.stats['enqueued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], len(self.items))
+            self.condition.notify_all()
+            return True
+
+    def make_room(self, keyframe):
+        if self.policy == "keyframe":
+            if keyframe:
+                self.dropping_gop = False
+            elif self.dropping_gop:
+                return False
+        if len(self.items) < self.maxsize:
+            return True
+        if self.policy == "drop_oldest":
+            self.evict()
+            return True
+        if self.policy == "block":
+            deadline = time.monotonic() + self.blockTimeout
+            while len(self.items) >= self.maxsize:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    return len(self.items) < self.maxsize
+            return True
+        if self.policy == "keyframe":
+            if not keyframe:
+                self.dropping_gop = True
+                return False
+            # Evict the oldest whole GOP to make room for the new one
+            self.evict()
+            while self.items and not self.items[0][1]:
+                self.evict()
+            return True
+        return False
+
+    def evict(self):
+        item, _ = self.items.popleft()
+        self.stats['dropped'] += 1
+        if self.onDrop is not None:
+            self.onDrop(item)
+
+    def drain(self):
+        # Takes out whatever is left, for a writer that stopped early
+        with self.condition:
+            items = [item for item, _ in self.items if item is not None]
+            self.items.clear()
+            return items
+
+    def close(self):
+        # The end-of-stream marker always gets in, whatever the policy
+        with self.condition:
+            self.items.append((None, True))
+            self.condition.notify_all()
+
+    def get(self):
+        with self.condition:
+            while not self.items:
+                self.condition.wait()
+            item, _ = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+def join_writer(thread, writer, stallTimeout=None):
+    # Waits for a writer thread to finish for as long as it keeps making
+    # progress. Returns False once it has spent more than stallTimeout seconds
+    # on one item (writer.busySince), the thread is then left behind.
+    while True:
+        thread.join(None if stallTimeout is None else 1.0)
+        if not thread.is_alive():
+            return True
+        busySince = writer.busySince
+        if busySince is not None and time.monotonic() - busySince > stallTimeout:
+            return False